@@ -0,0 +1,103 @@
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU cache for process-local memoization.
+
+    Args:
+        maxsize: Maximum number of entries, the least recently used one is evicted first
+        ttl: Optional default time-to-live in seconds for every entry
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, self._missing)
+
+            if entry is not self._missing:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory, ttl=None):
+        value = self.get(key, self._missing)
+        if value is self._missing:
+            # Computed outside the lock, concurrent misses may both compute
+            value = factory()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Every process keeps its own copy of these, nothing written is seen by another worker
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_process_local_cache(alias):
+    return settings.CACHES[alias]["BACKEND"] in PROCESS_LOCAL_CACHE_BACKENDS
+
+
+# incr() is a get() then a set() that also resets the key's timeout to the
+# default, and the file backend's add() is a has_key() then a set()
+NON_ATOMIC_CACHE_BACKENDS = (
+    "django.core.cache.backends.filebased.FileBasedCache",
+    "django.core.cache.backends.db.DatabaseCache",
+)
+
+
+def has_atomic_counters(alias):
+    return settings.CACHES[alias]["BACKEND"] not in NON_ATOMIC_CACHE_BACKENDS
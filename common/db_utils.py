@@ -0,0 +1,42 @@
+import time
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def delete_in_chunks(queryset, chunk_size=1000, sleep=0.0):
+    """
+    Deletes the rows of `queryset` in batches of `chunk_size` ids, in the
+    queryset's order, and returns how many were deleted. Every DELETE stays
+    short, so no long table locks. `sleep` pauses between chunks to leave
+    room for other writers.
+    """
+    total_deleted = 0
+
+    while True:
+        ids = list(queryset.values_list("pk", flat=True)[:chunk_size])
+        if not ids:
+            return total_deleted
+
+        deleted, _ = queryset.model.objects.filter(pk__in=ids).delete()
+        total_deleted += deleted
+
+        if sleep:
+            time.sleep(sleep)
+
+
+@contextmanager
+def capture_queries(using=DEFAULT_DB_ALIAS):
+    """
+    Collects the SQL of every query this thread runs on `using` inside the
+    block. An execute wrapper, so unlike CaptureQueriesContext it keeps
+    counting across the reset_queries() of each test client request.
+    """
+    statements = []
+
+    def record(execute, sql, params, many, context):
+        statements.append(sql)
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(record):
+        yield statements
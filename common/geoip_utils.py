@@ -0,0 +1,219 @@
+import csv
+import time
+import bisect
+import logging
+import ipaddress
+import threading
+from array import array
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .cache_utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LOCATION = "Unknown Location"
+
+
+def format_location(city, country):
+    return f"{city}, {country}"
+
+
+class RangeFileGeoIPBackend:
+    """
+    Offline lookups against a CSV of IP ranges with the columns
+    `start_ip,end_ip,city,country_name` (addresses or integers).
+
+    Ranges are compiled into sorted, compact arrays per IP version and
+    looked up with a binary search, so a lookup never touches the network.
+    """
+
+    def __init__(self, range_file=None, **kwargs):
+        self.range_file = range_file
+        # version -> (starts, ends, location indexes)
+        self.index = {4: (array("I"), array("I"), array("I")), 6: ([], [], array("I"))}
+        self.locations = []
+
+        if range_file:
+            self.load(range_file)
+
+    def load(self, range_file):
+        rows = {4: [], 6: []}
+        location_ids = {}
+
+        with open(range_file, newline="") as fp:
+            for row in csv.DictReader(fp):
+                start = ipaddress.ip_address(self.parse_address(row["start_ip"]))
+                end = ipaddress.ip_address(self.parse_address(row["end_ip"]))
+                location = format_location(row["city"], row["country_name"])
+
+                if location not in location_ids:
+                    location_ids[location] = len(self.locations)
+                    self.locations.append(location)
+
+                rows[start.version].append((int(start), int(end), location_ids[location]))
+
+        for version, version_rows in rows.items():
+            starts, ends, location_indexes = self.index[version]
+            for start, end, location_id in sorted(version_rows):
+                starts.append(start)
+                ends.append(end)
+                location_indexes.append(location_id)
+
+    @staticmethod
+    def parse_address(value):
+        value = value.strip()
+        return int(value) if value.isdigit() else value
+
+    def lookup(self, ip):
+        address = ipaddress.ip_address(ip)
+        starts, ends, location_indexes = self.index[address.version]
+
+        position = bisect.bisect_right(starts, int(address)) - 1
+        if position >= 0 and int(address) <= ends[position]:
+            return self.locations[location_indexes[position]]
+        return None
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for `reset_timeout` seconds once
+    `failure_threshold` consecutive calls have failed.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # Half-open: let a probe through once the timeout has passed
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class IPAPIGeoIPBackend:
+    """
+    Lookups against ipapi.co over a pooled session with a hard timeout,
+    guarded by a circuit breaker.
+    """
+
+    def __init__(self, timeout=1.5, **kwargs):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.circuit_breaker = CircuitBreaker()
+
+    def lookup(self, ip):
+        if not self.circuit_breaker.allow_request():
+            return None
+
+        try:
+            response = self.session.get(f"https://ipapi.co/{ip}/json/", timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            self.circuit_breaker.record_failure()
+            logger.warning("Geo-IP lookup for %s failed: %s", ip, e)
+            return None
+
+        self.circuit_breaker.record_success()
+
+        if data.get("error") or not data.get("country_name"):
+            return None
+        return format_location(data.get("city"), data.get("country_name"))
+
+
+class GeoIPResolver:
+    """
+    Resolves an IP to "City, Country" from a TTL/LRU cache (keyed by /24 for
+    IPv4) and the configured backend. Misses fall back to the HTTP backend
+    in the background, the caller gets UNKNOWN_LOCATION instead of waiting.
+    """
+
+    def __init__(self, backend, fallback_backend=None, cache_size=10000, cache_ttl=86400):
+        self.backend = backend
+        self.fallback_backend = fallback_backend
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="geoip") if fallback_backend else None
+        self.in_flight = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_cache_key(address):
+        if address.version == 4:
+            return str(ipaddress.ip_network(f"{address}/24", strict=False))
+        return str(address)
+
+    def resolve(self, ip):
+        try:
+            address = ipaddress.ip_address(str(ip).strip())
+        except ValueError:
+            return UNKNOWN_LOCATION
+
+        cache_key = self.get_cache_key(address)
+        location = self.cache.get(cache_key)
+        if location:
+            return location
+
+        location = self.backend.lookup(str(address))
+        if location:
+            self.cache.set(cache_key, location)
+            return location
+
+        if self.executor and address.is_global:
+            self.schedule_fallback(str(address), cache_key)
+
+        return UNKNOWN_LOCATION
+
+    def schedule_fallback(self, ip, cache_key):
+        with self._lock:
+            if cache_key in self.in_flight:
+                return
+            self.in_flight.add(cache_key)
+
+        self.executor.submit(self.run_fallback, ip, cache_key)
+
+    def run_fallback(self, ip, cache_key):
+        try:
+            location = self.fallback_backend.lookup(ip)
+            if location:
+                self.cache.set(cache_key, location)
+        finally:
+            with self._lock:
+                self.in_flight.discard(cache_key)
+
+
+@lru_cache(maxsize=None)
+def get_geoip_resolver():
+    backend = import_string(settings.GEOIP_BACKEND)(range_file=settings.GEOIP_RANGE_FILE)
+
+    fallback_backend = None
+    if settings.GEOIP_HTTP_FALLBACK:
+        fallback_backend = IPAPIGeoIPBackend(timeout=settings.GEOIP_HTTP_TIMEOUT)
+
+    return GeoIPResolver(
+        backend,
+        fallback_backend=fallback_backend,
+        cache_size=settings.GEOIP_CACHE_SIZE,
+        cache_ttl=settings.GEOIP_CACHE_TTL,
+    )
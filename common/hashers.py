@@ -0,0 +1,150 @@
+import logging
+import threading
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.module_loading import import_string
+
+from .perf_utils import timed
+
+logger = logging.getLogger(__name__)
+
+# Set in hashing pool workers, which always hash inline
+_is_hashing_worker = False
+
+
+def init_hashing_worker():
+    global _is_hashing_worker
+    _is_hashing_worker = True
+
+    import django
+    django.setup(set_prefix=False)
+
+
+def run_hasher_method(hasher_path, method_name, args):
+    return getattr(import_string(hasher_path)(), method_name)(*args)
+
+
+class HashingPool:
+    """
+    Process pool for password hashing, keeping CPU-bound work off the
+    request threads. At most `max_pending` hashes are queued or running,
+    a caller waiting longer than `queue_timeout` seconds for a slot gets
+    a 503 instead of piling up behind a login storm.
+    """
+
+    def __init__(self, max_workers, max_pending, queue_timeout):
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.executor = self.create_executor()
+
+    def create_executor(self):
+        # Spawned, not forked: request threads may hold locks and sockets
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_hashing_worker,
+        )
+
+    def run(self, hasher_path, method_name, *args):
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            # DRF can't be imported before django.setup() in a pool worker
+            from .exception_utils import CustomAPIException
+            raise CustomAPIException("Server is busy, please try again shortly", status_code=503)
+
+        executor = self.executor
+        try:
+            return executor.submit(run_hasher_method, hasher_path, method_name, args).result()
+        except BrokenProcessPool:
+            # A worker died, replace the pool for the next callers
+            logger.exception("Password hashing pool broke, recreating it")
+            with self._lock:
+                if self.executor is executor:
+                    self.executor = self.create_executor()
+            raise
+        finally:
+            self.slots.release()
+
+
+@lru_cache(maxsize=None)
+def get_hashing_pool():
+    if not settings.PASSWORD_HASHING_WORKERS:
+        return None
+
+    return HashingPool(
+        max_workers=settings.PASSWORD_HASHING_WORKERS,
+        max_pending=settings.PASSWORD_HASHING_MAX_PENDING,
+        queue_timeout=settings.PASSWORD_HASHING_QUEUE_TIMEOUT,
+    )
+
+
+class ConfiguredHasherMixin:
+    """
+    Runs encode(), verify() and harden_runtime() on the hashing pool when
+    one is configured and reports their time as "hash". Inside a pool worker
+    they always run inline.
+    """
+
+    def run_hashing(self, method_name, *args):
+        pool = None if _is_hashing_worker else get_hashing_pool()
+        with timed("hash"):
+            if pool is not None:
+                hasher_path = f"{type(self).__module__}.{type(self).__qualname__}"
+                try:
+                    return pool.run(hasher_path, method_name, *args)
+                except BrokenProcessPool:
+                    pass
+
+            return getattr(super(), method_name)(*args)
+
+    def encode(self, password, salt, *args):
+        return self.run_hashing("encode", password, salt, *args)
+
+    def verify(self, password, encoded):
+        return self.run_hashing("verify", password, encoded)
+
+    def harden_runtime(self, password, encoded):
+        return self.run_hashing("harden_runtime", password, encoded)
+
+
+# Same algorithms and stored formats as Django's. Work parameters come from
+# settings, a hash made with other parameters is upgraded on the next login.
+
+class PBKDF2PasswordHasher(ConfiguredHasherMixin, hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class PBKDF2SHA1PasswordHasher(ConfiguredHasherMixin, hashers.PBKDF2SHA1PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class ScryptPasswordHasher(ConfiguredHasherMixin, hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+
+class Argon2PasswordHasher(ConfiguredHasherMixin, hashers.Argon2PasswordHasher):
+    """Requires the optional argon2-cffi package."""
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+
+class BCryptSHA256PasswordHasher(ConfiguredHasherMixin, hashers.BCryptSHA256PasswordHasher):
+    pass
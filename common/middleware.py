@@ -0,0 +1,85 @@
+import json
+import time
+import random
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+
+from .perf_utils import collect_timings
+
+logger = logging.getLogger("perf")
+
+
+class PerformanceMiddleware:
+    """
+    Times a PERF_SAMPLE_RATE share of requests: wall time, database queries
+    and every `timed()` block run while handling them (password hashing).
+    Side effects run after the response and are not part of its timings.
+
+    Each sampled request is logged to the "perf" logger as one JSON line and,
+    with PERF_SERVER_TIMING, described in a Server-Timing response header.
+    Requests left out of the sample pay for one random() call and a ContextVar
+    lookup per query. With PERF_SAMPLE_RATE at 0 the query timer is not
+    installed at all.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PERF_SAMPLE_RATE
+        self.server_timing = settings.PERF_SERVER_TIMING
+
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        if not self.should_sample():
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with collect_timings() as timings:
+            response = self.get_response(request)
+        self.report(request, response, timings, started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_sample():
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        with collect_timings() as timings:
+            response = await self.get_response(request)
+        self.report(request, response, timings, started)
+        return response
+
+    def should_sample(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def report(self, request, response, timings, started):
+        total_ms = (time.perf_counter() - started) * 1000
+
+        if self.server_timing:
+            metrics = [f"total;dur={total_ms:.1f}"]
+            for name, duration_ms in timings.durations.items():
+                metric = f"{name};dur={duration_ms:.1f}"
+                if name == "db":
+                    metric += f';desc="{timings.counts[name]} queries"'
+                metrics.append(metric)
+            response["Server-Timing"] = ", ".join(metrics)
+
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(total_ms, 2),
+            "db_queries": timings.counts.get("db", 0),
+            "timings_ms": {name: round(duration_ms, 2) for name, duration_ms in timings.durations.items()},
+            "counts": timings.counts,
+        }))
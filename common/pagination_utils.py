@@ -0,0 +1,99 @@
+import json
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.encoding import force_str
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination over a unique ordering such as
+    ("-created_at", "-id"). The cursor holds the last row's ordering values
+    and the next page is a `WHERE (a, b) < (x, y) LIMIT n` range read, so
+    every page costs the same no matter how deep it is. Use an index that
+    matches the ordering.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.fields = [field.lstrip("-") for field in self.ordering]
+        self.descending = self.ordering[0].startswith("-")
+
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_seek_filter(cursor))
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_seek_filter(self, cursor):
+        # (a, b) < (x, y)  ==  a < x OR (a = x AND b < y)
+        lookup = "lt" if self.descending else "gt"
+        seek_filter = Q()
+        for position, field in enumerate(self.fields):
+            equal = {name: cursor[name] for name in self.fields[:position]}
+            seek_filter |= Q(**equal, **{f"{field}__{lookup}": cursor[field]})
+        return seek_filter
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            return {
+                field: model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values, strict=True)
+            }
+        except Exception:
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, instance):
+        values = [force_str(getattr(instance, field)) for field in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
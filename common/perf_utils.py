@@ -0,0 +1,83 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Timings of the sampled request being handled in this context, None otherwise
+_request_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Accumulated duration (ms) and call count per timer name for one request."""
+
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+        self.active = set()
+
+    def add(self, name, duration_ms):
+        self.durations[name] = self.durations.get(name, 0.0) + duration_ms
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def get_request_timings():
+    return _request_timings.get()
+
+
+@contextmanager
+def collect_timings():
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the block's duration to `name` in the current request's timings.
+    A no-op outside a sampled request, nested blocks of the same name are
+    counted once.
+    """
+    timings = _request_timings.get()
+    if timings is None or name in timings.active:
+        yield
+        return
+
+    timings.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - started) * 1000)
+        timings.active.discard(name)
+
+
+def db_execute_timer(execute, sql, params, many, context):
+    """
+    Database execute wrapper timing every query as "db". A plain function,
+    outside a sampled request it costs one ContextVar lookup per query.
+    """
+    timings = _request_timings.get()
+    if timings is None or "db" in timings.active:
+        return execute(sql, params, many, context)
+
+    timings.active.add("db")
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add("db", (time.perf_counter() - started) * 1000)
+        timings.active.discard("db")
+
+
+def install_db_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver, only connected when PERF_SAMPLE_RATE is
+    above 0. The wrapper stays installed for the connection's lifetime, so
+    queries run from other threads or from sync_to_async on behalf of a
+    request are timed too.
+    """
+    if db_execute_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_timer)
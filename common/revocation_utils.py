@@ -0,0 +1,174 @@
+import math
+import time
+import hashlib
+import threading
+
+
+class BloomFilter:
+    """
+    Fixed-size set membership with no false negatives and about `error_rate`
+    false positives once `capacity` keys were added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def get_positions(self, key):
+        # Double hashing, one digest gives every position
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self.get_positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(key))
+
+
+class RevocationStore:
+    """
+    Revoked ids (e.g. JWT jti claims) that expire on their own.
+
+    The cache holds `revoked:<id>` until the id's expiry and is the source of
+    truth. Every revocation is also appended to a log in the cache that each
+    process replays, at most every `sync_interval` seconds, into a local Bloom
+    filter. Lookups of ids that were never revoked, nearly all of them, stop
+    at the Bloom filter without touching the cache.
+
+    The filter is rotated every `max_ttl` seconds and the previous generation
+    is kept, so each id stays in it for at least its lifetime. A cache that
+    evicts entries early must be sized to hold the log.
+
+    The log records when it was started. Until it is `max_ttl` old, ids
+    revoked before it may still be live, so a process replaying it (on its
+    first sync, or once the cache lost the log and a new one was started)
+    also replays `backfill`.
+
+    Args:
+        cache: Cache shared by every process
+        max_ttl: Longest lifetime of a revoked id, in seconds
+        fallback: Optional callable(id) -> bool, asked when the Bloom filter
+            matches but the cache has no entry, e.g. a durable copy in the database
+        backfill: Optional callable() -> iterable of ids, replayed into the Bloom
+            filter when the log may not hold every live id, e.g. after the
+            cache was flushed
+    """
+    SEQUENCE_KEY = "revoked:seq"
+    STARTED_AT_KEY = "revoked:started_at"
+    SYNC_CHUNK_SIZE = 1000
+
+    def __init__(self, cache, max_ttl, capacity=1000000, error_rate=0.001, sync_interval=1.0, fallback=None, backfill=None):
+        self.cache = cache
+        self.max_ttl = max_ttl
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.fallback = fallback
+        self.backfill = backfill
+
+        self.filters = [BloomFilter(capacity, error_rate)]
+        self.rotated_at = time.monotonic()
+        self.synced_sequence = None
+        self.synced_started_at = None
+        self.synced_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_cache_key(key):
+        return f"revoked:{key}"
+
+    @staticmethod
+    def get_log_key(sequence):
+        return f"revoked:log:{sequence}"
+
+    def revoke(self, key, ttl):
+        """
+        Returns False when `key` was already revoked (or has expired), so of
+        concurrent calls for one key exactly one gets True. Needs a cache with
+        an atomic add().
+        """
+        if ttl <= 0:
+            return False
+
+        if not self.cache.add(self.get_cache_key(key), 1, ttl):
+            return False
+
+        if self.cache.add(self.SEQUENCE_KEY, 0, None):
+            # A new log, the first one or the old one was lost with the cache
+            self.cache.set(self.STARTED_AT_KEY, time.time(), None)
+        sequence = self.cache.incr(self.SEQUENCE_KEY)
+        # Same lifetime for every entry, so the log expires oldest first
+        self.cache.set(self.get_log_key(sequence), key, self.max_ttl)
+
+        with self._lock:
+            self.filters[0].add(key)
+        return True
+
+    def is_revoked(self, key):
+        self.sync()
+
+        if not any(key in bloom_filter for bloom_filter in self.filters):
+            return False
+
+        if self.cache.get(self.get_cache_key(key)) is not None:
+            return True
+        return bool(self.fallback and self.fallback(key))
+
+    def sync(self):
+        now = time.monotonic()
+        if now - self.synced_at < self.sync_interval:
+            return
+
+        with self._lock:
+            if now - self.synced_at < self.sync_interval:
+                return
+
+            if now - self.rotated_at >= self.max_ttl:
+                self.filters = [BloomFilter(self.capacity, self.error_rate), self.filters[0]]
+                self.rotated_at = now
+
+            values = self.cache.get_many([self.SEQUENCE_KEY, self.STARTED_AT_KEY])
+            sequence = values.get(self.SEQUENCE_KEY, 0)
+            started_at = values.get(self.STARTED_AT_KEY)
+
+            if (
+                self.synced_sequence is None
+                or started_at != self.synced_started_at
+                or sequence < self.synced_sequence
+            ):
+                # First sync, or the cache lost the log and a new one was started
+                self.replay_log(sequence, started_at)
+            elif sequence > self.synced_sequence:
+                self.read_log(self.synced_sequence + 1, sequence)
+
+            self.synced_sequence = sequence
+            self.synced_started_at = started_at
+            self.synced_at = now
+
+    def read_log(self, first, last):
+        for start in range(first, last + 1, self.SYNC_CHUNK_SIZE):
+            keys = [self.get_log_key(n) for n in range(start, min(start + self.SYNC_CHUNK_SIZE, last + 1))]
+            for key in self.cache.get_many(keys).values():
+                self.filters[0].add(key)
+
+    def replay_log(self, last, started_at):
+        # Ids revoked before the log was started live for at most max_ttl
+        if self.backfill and (started_at is None or time.time() - started_at < self.max_ttl):
+            for key in self.backfill():
+                self.filters[0].add(key)
+
+        # Walk back until a whole chunk has expired
+        end = last
+        while end > 0:
+            start = max(end - self.SYNC_CHUNK_SIZE + 1, 1)
+            keys = [self.get_log_key(n) for n in range(start, end + 1)]
+            found = self.cache.get_many(keys)
+            if not found:
+                break
+            for key in found.values():
+                self.filters[0].add(key)
+            end = start - 1
@@ -1,3 +1,6 @@
+from django.db import transaction
+from django.utils import timezone
+
 def error_formatter(error):
 
     was_not_list = False
@@ -21,36 +24,91 @@ def error_formatter(error):
 
     return res
 
+class DynamicFieldsMixin:
+    """
+    Serializer mixin taking an optional `fields` argument, only those of the
+    declared fields are serialized.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
 def get_serialized_or_none(serializer_class, instance):
     if instance:
         return serializer_class(instance).data
     return None
 
-def update_nested_objects(model_class, nested_data_list, extra_fields=None):
+def update_nested_objects(model_class, nested_data_list, extra_fields=None, delete_missing=False):
     """
     Utility function to handle updating/creating nested objects with optional extra fields.
+    Existing rows are fetched with one in_bulk and saved with one bulk_update, new rows
+    are saved with one bulk_create, all inside a single transaction.
     
     Args:
         model_class: The Django model class to update/create instances for
-        nested_data_list: List of dictionaries containing the data for nested objects
+        nested_data_list: List of dictionaries containing the data for nested objects, left unmodified
         extra_fields: Optional dict of field names and values to add (e.g., {'organization': instance})
+        delete_missing: Delete rows matching extra_fields whose id is not in nested_data_list
     
     Returns:
         None
     """
+    if delete_missing and not extra_fields:
+        raise ValueError("delete_missing requires extra_fields to scope the rows to delete")
+
+    existing_items = {}
+    new_items = []
+
     for item_data in nested_data_list:
         if not isinstance(item_data, dict):
             continue
-            
-        # Add extra fields if provided
-        if extra_fields and isinstance(extra_fields, dict):
-            item_data.update(extra_fields)
-            
+
+        # Work on a copy, the caller's dicts stay untouched
+        item_data = {**item_data, **(extra_fields or {})}
+
         if "id" in item_data:
-            item_id = item_data.pop('id')
-            model_class.objects.update_or_create(
-                id=item_id,
-                defaults=item_data
-            )
+            # in_bulk keys are the pk's Python type, an id sent as "5" would miss its row
+            existing_items[model_class._meta.pk.to_python(item_data.pop("id"))] = item_data
         else:
-            model_class.objects.create(**item_data)
+            new_items.append(item_data)
+
+    # bulk_update doesn't run pre_save, refresh auto_now fields by hand
+    now = timezone.now()
+    auto_now_fields = [
+        field.name for field in model_class._meta.concrete_fields
+        if getattr(field, "auto_now", False)
+    ]
+
+    with transaction.atomic():
+        if delete_missing:
+            model_class.objects.filter(**extra_fields).exclude(id__in=existing_items).delete()
+
+        instances = model_class.objects.in_bulk(list(existing_items))
+        to_update = []
+        update_fields = set(auto_now_fields)
+
+        for item_id, item_data in existing_items.items():
+            instance = instances.get(item_id)
+
+            if instance is None:
+                # Same as update_or_create: an unknown id is created with that id
+                new_items.append({"id": item_id, **item_data})
+                continue
+
+            for field_name, value in item_data.items():
+                setattr(instance, field_name, value)
+            for field_name in auto_now_fields:
+                setattr(instance, field_name, now)
+
+            update_fields.update(item_data)
+            to_update.append(instance)
+
+        if to_update:
+            model_class.objects.bulk_update(to_update, list(update_fields))
+        if new_items:
+            model_class.objects.bulk_create([model_class(**item_data) for item_data in new_items])
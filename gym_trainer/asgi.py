@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gym_trainer.settings')
 
 application = get_asgi_application()
+
+if settings.WARM_CACHES_ON_STARTUP:
+    # Before the first request instead of during it
+    from users.services import CacheWarmupService
+    CacheWarmupService.warm_process()
@@ -11,9 +11,11 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import logging
 from decouple import config
 from datetime import timedelta, datetime
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -50,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its wall time covers the whole stack
+    'common.middleware.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -84,12 +88,137 @@ WSGI_APPLICATION = 'gym_trainer.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL when DB_NAME is set, SQLite at SQLITE_PATH (db.sqlite3) otherwise
+
+DB_NAME = config('DB_NAME', default='')
+
+if DB_NAME:
+    # Django's native psycopg pool, incompatible with persistent connections
+    DB_POOL = config('DB_POOL', default=True, cast=bool)
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': DB_NAME,
+            'USER': config('DB_USER'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+                    'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+                    'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+                },
+            } if DB_POOL else {},
+        }
+    }
+
+    # Trigram indexes behind the user search, see users.services.UserSearchService
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+    # Optional read replica, used by views with common.db_routers.ReplicaReadMixin
+    DB_REPLICA_HOST = config('DB_REPLICA_HOST', default='')
+
+    if DB_REPLICA_HOST:
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': DB_REPLICA_HOST,
+            'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+            'OPTIONS': {**DATABASES['default']['OPTIONS']},
+            'TEST': {'MIRROR': 'default'},
+        }
+        DATABASE_ROUTERS = ['common.db_routers.PrimaryReplicaRouter']
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('SQLITE_PATH', default=BASE_DIR / 'db.sqlite3'),
+            # A file rather than SQLite's in-memory test database, which
+            # fails concurrent writers instead of making them wait
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
     }
+
+    # Single-node deployments where several workers write to the same file
+    if config('SQLITE_PERFORMANCE_PROFILE', default=False, cast=bool):
+        DATABASES['default']['OPTIONS'] = {
+            # Take the write lock at BEGIN, a deferred transaction that later
+            # writes fails with "database is locked" instead of waiting
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': config('SQLITE_BUSY_TIMEOUT', default=5, cast=int),
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                f"PRAGMA busy_timeout={config('SQLITE_BUSY_TIMEOUT', default=5, cast=int) * 1000};"
+                f"PRAGMA mmap_size={config('SQLITE_MMAP_SIZE', default=134217728, cast=int)};"
+                f"PRAGMA cache_size={config('SQLITE_CACHE_SIZE', default=-20000, cast=int)};"
+            ),
+        }
+
+
+# Cache Config
+# ============
+
+# Backend of each alias, one of CACHE_BACKENDS. locmem is per process, the
+# others are shared by every worker: "db" needs `manage.py createcachetable`,
+# "redis" the redis package and REDIS_URL. "file" and "db" have no atomic
+# counters, `check --deploy` refuses them for the throttling and revocation
+# aliases (users.E003).
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
 }
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+# Bumping it on deploy orphans every key written in an older format
+CACHE_VERSION = config('CACHE_VERSION', default=1, cast=int)
+CACHE_KEY_PREFIX = config('CACHE_KEY_PREFIX', default='gym_trainer')
+CACHE_MAX_ENTRIES = config('CACHE_MAX_ENTRIES', default=100000, cast=int)
+
+
+def get_cache_config(alias):
+    """Builds one CACHES entry, <ALIAS>_CACHE_BACKEND and <ALIAS>_CACHE_LOCATION override the shared settings."""
+    backend = config(f'{alias.upper()}_CACHE_BACKEND', default=CACHE_BACKEND)
+    if backend not in CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f"{alias.upper()}_CACHE_BACKEND must be one of {', '.join(CACHE_BACKENDS)}"
+        )
+
+    default_location = {
+        'locmem': alias,
+        'file': str(BASE_DIR / 'cache' / alias),
+        'db': f'cache_{alias}',
+        'redis': REDIS_URL,
+    }[backend]
+
+    cache_config = {
+        'BACKEND': CACHE_BACKENDS[backend],
+        'LOCATION': config(f'{alias.upper()}_CACHE_LOCATION', default=default_location),
+        # Aliases may share a Redis database or a directory, never a key
+        'KEY_PREFIX': f'{CACHE_KEY_PREFIX}:{alias}',
+        'VERSION': CACHE_VERSION,
+    }
+    if backend != 'redis':
+        # Django's default of 300 entries would evict the token versions
+        cache_config['OPTIONS'] = {'MAX_ENTRIES': CACHE_MAX_ENTRIES}
+    return cache_config
+
+
+CACHES = {
+    alias: get_cache_config(alias)
+    for alias in ('default', 'sessions', 'throttling', 'otp')
+}
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Preload roles and email assets in every web worker, see users.services.CacheWarmupService
+WARM_CACHES_ON_STARTUP = config('WARM_CACHES_ON_STARTUP', default=False, cast=bool)
 
 
 # Password validation
@@ -110,6 +239,44 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# Tune the work parameters with `manage.py benchmark_password_hashers --target-ms`
+
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': 'common.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'common.hashers.ScryptPasswordHasher',
+    # Needs the argon2-cffi package
+    'argon2': 'common.hashers.Argon2PasswordHasher',
+}
+
+# New hashes use the profile's algorithm. Hashes made by another algorithm or
+# with other parameters still verify and are upgraded on the user's next login.
+PASSWORD_HASHER_PROFILE = config('PASSWORD_HASHER_PROFILE', default='pbkdf2')
+
+if PASSWORD_HASHER_PROFILE not in PASSWORD_HASHER_PROFILES:
+    raise ImproperlyConfigured(
+        f"PASSWORD_HASHER_PROFILE must be one of {', '.join(PASSWORD_HASHER_PROFILES)}"
+    )
+
+PASSWORD_HASHERS = [
+    PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE],
+    *[path for name, path in PASSWORD_HASHER_PROFILES.items() if name != PASSWORD_HASHER_PROFILE],
+    'common.hashers.PBKDF2SHA1PasswordHasher',
+    'common.hashers.BCryptSHA256PasswordHasher',
+]
+
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=870000, cast=int)
+# scrypt N, a power of 2
+PASSWORD_SCRYPT_WORK_FACTOR = config('PASSWORD_SCRYPT_WORK_FACTOR', default=2 ** 14, cast=int)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', default=2, cast=int)
+# In KiB
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', default=102400, cast=int)
+
+# Hash on a pool of worker processes instead of the request thread, 0 turns it off
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', default=0, cast=int)
+# Hashes queued or running at once, callers waiting longer than the timeout get a 503
+PASSWORD_HASHING_MAX_PENDING = config('PASSWORD_HASHING_MAX_PENDING', default=32, cast=int)
+PASSWORD_HASHING_QUEUE_TIMEOUT = config('PASSWORD_HASHING_QUEUE_TIMEOUT', default=5, cast=float)
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -149,12 +316,26 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'EXCEPTION_HANDLER': 'common.exception_utils.custom_exception_handler',
+    # Reverse proxies in front of the app, the client IP is the X-Forwarded-For
+    # entry the outermost one appended. 0 ignores the header, which clients control.
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
+    # Keyed "<view throttle_scope>_<ip|email>", see users.throttling
+    'DEFAULT_THROTTLE_RATES': {
+        'register_ip': config('THROTTLE_REGISTER_IP', default='10/hour'),
+        'register_email': config('THROTTLE_REGISTER_EMAIL', default='3/hour'),
+        'login_ip': config('THROTTLE_LOGIN_IP', default='30/min'),
+        'login_email': config('THROTTLE_LOGIN_EMAIL', default='10/min'),
+        'otp_ip': config('THROTTLE_OTP_IP', default='10/hour'),
+        'otp_email': config('THROTTLE_OTP_EMAIL', default='5/hour'),
+        'verify_otp_ip': config('THROTTLE_VERIFY_OTP_IP', default='30/min'),
+        'verify_otp_email': config('THROTTLE_VERIFY_OTP_EMAIL', default='10/min'),
+    },
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.FormParser',
@@ -162,15 +343,20 @@ REST_FRAMEWORK = {
     ],
 }
 
+THROTTLE_CACHE_ALIAS = config("THROTTLE_CACHE_ALIAS", default="throttling")
+
 # JWT Config
 # ==========
 
 SIMPLE_JWT = {
-    # "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
-    "ACCESS_TOKEN_LIFETIME": timedelta(days=5),
+    # Short-lived, clients refresh instead of carrying a revocable token for days
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=config('JWT_ACCESS_TOKEN_MINUTES', default=15, cast=int)),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=10),
-    "ROTATE_REFRESH_TOKENS": False,
+    "ROTATE_REFRESH_TOKENS": config('JWT_ROTATE_REFRESH_TOKENS', default=True, cast=bool),
+    # Used refresh tokens are revoked by users.serializers.RotatingTokenRefreshSerializer
+    # through users.services.TokenRevocationService, not by the blacklist app
     "BLACKLIST_AFTER_ROTATION": False,
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.RotatingTokenRefreshSerializer",
     "UPDATE_LAST_LOGIN": False,
 
     "ALGORITHM": "HS256",
@@ -195,6 +381,25 @@ SIMPLE_JWT = {
     "JTI_CLAIM": "jti",
 }
 
+# Token Revocation Config
+# =======================
+
+# Must be shared by every worker, `check --deploy` rejects a per-process cache
+TOKEN_REVOCATION_CACHE_ALIAS = config('TOKEN_REVOCATION_CACHE_ALIAS', default='default')
+# Per-process Bloom filter in front of the cache, ~1.8 MB for a million ids at 0.1%
+TOKEN_REVOCATION_BLOOM_CAPACITY = config('TOKEN_REVOCATION_BLOOM_CAPACITY', default=1000000, cast=int)
+TOKEN_REVOCATION_BLOOM_ERROR_RATE = config('TOKEN_REVOCATION_BLOOM_ERROR_RATE', default=0.001, cast=float)
+# Seconds until a revocation made by another process is seen by this one
+TOKEN_REVOCATION_SYNC_INTERVAL = config('TOKEN_REVOCATION_SYNC_INTERVAL', default=1.0, cast=float)
+# Also keep revocations in the database, to survive losing the cache
+TOKEN_REVOCATION_DB_WRITE_BEHIND = config('TOKEN_REVOCATION_DB_WRITE_BEHIND', default=True, cast=bool)
+
+# User Response Cache Config
+# ==========================
+
+# Seconds a serialized /users/me/ response is kept for its user version, 0 turns it off
+USER_RESPONSE_CACHE_TIMEOUT = config('USER_RESPONSE_CACHE_TIMEOUT', default=86400, cast=int)
+
 # CORS Config
 # ===========
 
@@ -235,6 +440,71 @@ EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL")
 
+# Email Queue Config
+# ==================
+
+EMAIL_QUEUE_ENABLED = config("EMAIL_QUEUE_ENABLED", default=True, cast=bool)
+EMAIL_QUEUE_BATCH_SIZE = config("EMAIL_QUEUE_BATCH_SIZE", default=20, cast=int)
+EMAIL_QUEUE_MAX_ATTEMPTS = config("EMAIL_QUEUE_MAX_ATTEMPTS", default=5, cast=int)
+EMAIL_QUEUE_LEASE_SECONDS = config("EMAIL_QUEUE_LEASE_SECONDS", default=300, cast=int)
+EMAIL_QUEUE_RETRY_BASE_SECONDS = config("EMAIL_QUEUE_RETRY_BASE_SECONDS", default=30, cast=int)
+EMAIL_QUEUE_RETRY_MAX_SECONDS = config("EMAIL_QUEUE_RETRY_MAX_SECONDS", default=3600, cast=int)
+
+# Max number of cached static paths, MIME parts and templates used by emails
+EMAIL_ASSET_CACHE_SIZE = config("EMAIL_ASSET_CACHE_SIZE", default=64, cast=int)
+
+# OTP Config
+# ==========
+
+# users.services.DatabaseOTPStore or users.services.CacheOTPStore
+OTP_STORE_BACKEND = config("OTP_STORE_BACKEND", default="users.services.DatabaseOTPStore")
+# Used by CacheOTPStore, which needs it shared by every worker (users.E005)
+OTP_CACHE_ALIAS = config("OTP_CACHE_ALIAS", default="otp")
+
+# Side Effects Config
+# ===================
+
+# Threads running deferred side effects, and how many may wait for one
+SIDE_EFFECT_WORKERS = config("SIDE_EFFECT_WORKERS", default=4, cast=int)
+SIDE_EFFECT_MAX_PENDING = config("SIDE_EFFECT_MAX_PENDING", default=1000, cast=int)
+
+# django-after-response only hands work to SIDE_EFFECT_WORKERS,
+# don't let it start a thread per task
+AFTER_RESPONSE_RUN_ASYNC = False
+
+# Geo-IP Config
+# =============
+
+# Must be a local backend, the login path never waits on the network
+GEOIP_BACKEND = config("GEOIP_BACKEND", default="common.geoip_utils.RangeFileGeoIPBackend")
+# CSV with start_ip,end_ip,city,country_name columns
+GEOIP_RANGE_FILE = config("GEOIP_RANGE_FILE", default="")
+# Resolve misses through ipapi.co in the background
+GEOIP_HTTP_FALLBACK = config("GEOIP_HTTP_FALLBACK", default=False, cast=bool)
+GEOIP_HTTP_TIMEOUT = config("GEOIP_HTTP_TIMEOUT", default=1.5, cast=float)
+GEOIP_CACHE_SIZE = config("GEOIP_CACHE_SIZE", default=10000, cast=int)
+GEOIP_CACHE_TTL = config("GEOIP_CACHE_TTL", default=86400, cast=int)
+
+# Login Info Config
+# =================
+
+# Distinct user-agent strings whose parsed "browser on OS" is kept in memory
+USER_AGENT_CACHE_SIZE = config("USER_AGENT_CACHE_SIZE", default=1024, cast=int)
+
+# Login events are buffered in memory and written in one INSERT per batch
+LOGIN_EVENT_BUFFER_SIZE = config("LOGIN_EVENT_BUFFER_SIZE", default=100, cast=int)
+LOGIN_EVENT_FLUSH_MS = config("LOGIN_EVENT_FLUSH_MS", default=2000, cast=int)
+# Default age in days for prune_login_events
+LOGIN_EVENT_RETENTION_DAYS = config("LOGIN_EVENT_RETENTION_DAYS", default=90, cast=int)
+
+# Performance Config
+# ==================
+
+# Share of requests timed by common.middleware.PerformanceMiddleware, 0 turns it off
+PERF_SAMPLE_RATE = config("PERF_SAMPLE_RATE", default=0.0, cast=float)
+# Expose the sampled timings to clients in a Server-Timing header
+PERF_SERVER_TIMING = config("PERF_SERVER_TIMING", default=DEBUG, cast=bool)
+
 # Logging config
 # ==============
 
@@ -246,11 +516,18 @@ LOGGING = {
         'django.request': {
             'handlers': ['file'],
             'level': 'WARNING',
+            # Already written by the handler above, not again through 'django'
+            'propagate': False,
         },
-        'dajngo': {
+        'django': {
             'handlers': ['file'],
             'level': 'ERROR',
         },
+        'perf': {
+            'handlers': ['perf_buffer'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
     'handlers': {
         'file': {
@@ -259,12 +536,31 @@ LOGGING = {
             'filename': f'logs/debug-{logdate}.log',
             'formatter' : 'simple'
         },
+        # Writes the perf lines in batches instead of flushing the file once per request
+        'perf_buffer': {
+            'level': 'INFO',
+            'class': 'logging.handlers.MemoryHandler',
+            'capacity': 100,
+            'flushLevel': logging.ERROR,
+            'target': 'perf_file',
+        },
+        'perf_file': {
+            'level': 'INFO',
+            'class': 'logging.FileHandler',
+            'filename': f'logs/perf-{logdate}.log',
+            'formatter' : 'message'
+        },
     },
     'formatters' : {
         'simple' : {
             'format' : '{levelname} {name} {asctime} {message}',
             'style' : '{'
-        }
+        },
+        # One JSON object per line
+        'message' : {
+            'format' : '{message}',
+            'style' : '{'
+        },
     }
 }
 
@@ -1,7 +1,9 @@
 from django.contrib import admin
+from django.db.models import Q
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
-from .models import User, Role, UserProfile, OTP
+from .models import User, Role, UserProfile, OTP, OutboundEmail, LoginEvent
+from .services import UserSearchService
 
 
 @admin.register(User)
@@ -9,7 +11,8 @@ class UserAdmin(BaseUserAdmin):
     model = User
     list_display = ('id', 'email', 'username', 'is_staff', 'is_active', 'created_at')
     list_filter = ('is_staff', 'is_superuser', 'is_active')
-    search_fields = ('email', 'username')
+    # Searched by get_search_results through UserSearchService
+    search_fields = ('email', 'userprofile__full_name')
     ordering = ('-created_at',)
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
@@ -25,6 +28,9 @@ class UserAdmin(BaseUserAdmin):
     )
     readonly_fields = ('created_at', 'updated_at')
 
+    def get_search_results(self, request, queryset, search_term):
+        return queryset.filter(UserSearchService.get_filter(search_term)), False
+
 
 @admin.register(Role)
 class RoleAdmin(admin.ModelAdmin):
@@ -36,15 +42,49 @@ class RoleAdmin(admin.ModelAdmin):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'full_name', 'role', 'created_at')
+    list_select_related = ('user', 'role')
+    # Searched by get_search_results through UserSearchService
     search_fields = ('user__email', 'full_name', )
     list_filter = ('role',)
     ordering = ('-created_at',)
 
+    def get_search_results(self, request, queryset, search_term):
+        return queryset.filter(UserSearchService.get_filter(search_term, user_lookup='user_id')), False
+
 
 @admin.register(OTP)
 class OTPAdmin(admin.ModelAdmin):
     list_display = ('user', 'otp', 'type', 'used', 'expire_at')
-    search_fields = ('user__email', 'otp', 'type')
+    list_select_related = ('user',)
+    # Searched by get_search_results, the type has its own list filter
+    search_fields = ('user__email', 'otp')
     list_filter = ('used', 'type')
     ordering = ('-expire_at',)
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        search_filter = UserSearchService.get_filter(search_term, user_lookup='user_id')
+
+        # An exact code match instead of casting the integer column to text
+        if search_term.isdigit():
+            search_filter |= Q(otp=int(search_term))
+
+        return queryset.filter(search_filter), False
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    search_fields = ('to_email', 'subject')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(LoginEvent)
+class LoginEventAdmin(admin.ModelAdmin):
+    list_display = ('email', 'ip', 'device', 'location', 'success', 'created_at')
+    search_fields = ('email', 'ip')
+    list_filter = ('success',)
+    ordering = ('-created_at',)
+    raw_id_fields = ('user',)
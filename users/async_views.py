@@ -0,0 +1,169 @@
+# async_views.py
+# Async-native variants of the auth views for ASGI deployments. DRF views are
+# sync only, these are plain Django views returning the same payloads.
+import json
+
+from asgiref.sync import sync_to_async
+
+from django.views import View
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+
+from rest_framework.exceptions import Throttled
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from common.exception_utils import CustomAPIException
+
+from .models import User
+from .authentication import StatelessJWTAuthentication
+from .services import EmailService, OTPService, UserService, UserResponseCacheService
+from .serializers import UserSerializer, ResetPasswordSerializer
+from .throttling import IPRateThrottle, EmailRateThrottle
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAPIView(View):
+    throttle_classes = []
+    throttle_scope = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body", "details": {}}, status=400)
+        # The views read fields off it, an array or a scalar has none
+        if not isinstance(request.data, dict):
+            return JsonResponse({"error": "JSON body must be an object", "details": {}}, status=400)
+
+        try:
+            # The throttle counters are sync cache calls, a database or file cache
+            # would block the event loop or raise SynchronousOnlyOperation
+            await sync_to_async(self.check_throttles)(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except CustomAPIException as exc:
+            return JsonResponse({"error": exc.message, "details": exc.data}, status=exc.status_code)
+        except Throttled as exc:
+            response = JsonResponse({"detail": str(exc.detail)}, status=exc.status_code)
+            response["Retry-After"] = str(exc.wait)
+            return response
+
+    def check_throttles(self, request):
+        for throttle in [throttle_class() for throttle_class in self.throttle_classes]:
+            if not throttle.allow_request(request, self):
+                raise Throttled(throttle.wait())
+
+    async def authenticate(self, request):
+        """Validates the bearer token and loads the user, profile and role in one query."""
+        authentication = StatelessJWTAuthentication()
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header else None
+        if raw_token is None:
+            raise CustomAPIException("Authentication credentials were not provided.", status_code=401)
+
+        try:
+            # The revocation check may fall back to the database
+            validated_token = await sync_to_async(authentication.get_validated_token)(raw_token)
+            user = await User.objects.select_related("userprofile__role").aget(
+                **{api_settings.USER_ID_FIELD: validated_token[api_settings.USER_ID_CLAIM]}
+            )
+        except (InvalidToken, TokenError, KeyError, User.DoesNotExist):
+            raise CustomAPIException("Given token not valid for any user", status_code=401)
+
+        if not user.is_active:
+            raise CustomAPIException("User is inactive", status_code=401)
+        return user
+
+
+class AsyncGenerateOTPView(AsyncAPIView):
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = "otp"
+
+    async def post(self, request):
+        email = request.data.get("email")
+        otp_type = "forget_password"
+
+        try:
+            user = await User.objects.aget(email=email)
+        except User.DoesNotExist:
+            raise CustomAPIException("User not found", status_code=404)
+
+        otp_code, otp_minutes = await OTPService.acreate_otp(user, otp_type)
+        await EmailService.asend_forget_password_mail(user.email, otp_code, otp_minutes)
+
+        return JsonResponse({"message": "OTP sent successfully"})
+
+
+class AsyncVerifyOTPView(AsyncAPIView):
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = "verify_otp"
+
+    async def post(self, request):
+        email, otp = request.data.get("email"), request.data.get("otp")
+        try:
+            otp = int(otp)
+        except (TypeError, ValueError):
+            raise CustomAPIException("Invalid data was given", data={"otp": ["A valid integer is required."]})
+
+        user_id, otp_type = await OTPService.aconsume_otp(email, otp)
+
+        if otp_type == "forget_password":
+            user = await User.objects.aget(pk=user_id)
+            token = UserService.generate_password_reset_token(user)
+            return JsonResponse({"message": "OTP verified", "reset_token": token})
+
+        await User.objects.filter(pk=user_id).aupdate(is_active=True, updated_at=timezone.now())
+        await sync_to_async(UserResponseCacheService.invalidate)(user_id)
+        return JsonResponse({"message": "OTP verified and account activated"})
+
+
+class AsyncResetPasswordView(AsyncAPIView):
+
+    async def post(self, request):
+        serializer = ResetPasswordSerializer(data=request.data)
+        # Only looks the user up and checks the reset token
+        if not await sync_to_async(serializer.is_valid)():
+            raise CustomAPIException("Invalid data was given", data=serializer.errors)
+
+        user = serializer.validated_data["user"]
+        # Hashing is CPU-bound, keep it off the event loop
+        await sync_to_async(user.set_password, thread_sensitive=False)(serializer.validated_data["new_password"])
+        await user.asave(update_fields=["password", "updated_at"])
+
+        return JsonResponse({"message": "Password reset successfully"})
+
+
+class AsyncGetUpdateUserView(AsyncAPIView):
+    """
+    GET, PUT, PATCH and DELETE of the requesting user, like GetUpdateUserView
+    without its response cache and conditional GETs.
+    """
+
+    async def get(self, request):
+        user = await self.authenticate(request)
+        return JsonResponse(UserSerializer(user).data)
+
+    async def put(self, request):
+        return await self.update(request, partial=False)
+
+    async def patch(self, request):
+        return await self.update(request, partial=True)
+
+    async def delete(self, request):
+        user = await self.authenticate(request)
+        await user.adelete()
+        return HttpResponse(status=204)
+
+    async def update(self, request, partial):
+        user = await self.authenticate(request)
+        serializer = UserSerializer(user, data=request.data, partial=partial)
+
+        def save():
+            if not serializer.is_valid():
+                raise CustomAPIException("Invalid data was given", data=serializer.errors)
+            return serializer.save()
+
+        await sync_to_async(save)()
+        return JsonResponse(UserSerializer(user).data)
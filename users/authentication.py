@@ -0,0 +1,49 @@
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class ClaimsUser(TokenUser):
+    """
+    Request user built from the access token's claims (user_id, email,
+    full_name, role), no User row is loaded.
+    """
+    is_stateless = True
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Trusts the token's claims on read requests while the user's token version
+    in the cache matches the token's `ver` claim, which needs a default cache
+    shared by every worker. Writes, inactive users, stale claims and
+    per-process caches fall back to loading the User row. Revoked tokens are
+    rejected through TokenRevocationService, without a query.
+    """
+
+    def authenticate(self, request):
+        # Authenticators are instantiated per request
+        self.request_method = request.method
+        return super().authenticate(request)
+
+    def get_validated_token(self, raw_token):
+        # users.services imports DRF, which loads this module from settings
+        from .services import TokenRevocationService
+
+        validated_token = super().get_validated_token(raw_token)
+        if TokenRevocationService.is_revoked(validated_token):
+            raise InvalidToken("Token is revoked")
+        return validated_token
+
+    def get_user(self, validated_token):
+        # users.services imports DRF, which loads this module from settings
+        from .services import TokenVersionService
+
+        if (
+            self.request_method in SAFE_METHODS
+            and validated_token.get("is_active")
+            and TokenVersionService.is_current(validated_token)
+        ):
+            return ClaimsUser(validated_token)
+
+        return super().get_user(validated_token)
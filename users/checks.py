@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.utils.module_loading import import_string
+
+from common.cache_utils import has_atomic_counters, is_process_local_cache
+
+from .services import CacheOTPStore
+
+
+@register()
+def check_throttle_cache(app_configs, **kwargs):
+    if not is_process_local_cache(settings.THROTTLE_CACHE_ALIAS):
+        return []
+
+    return [Warning(
+        f"THROTTLE_CACHE_ALIAS '{settings.THROTTLE_CACHE_ALIAS}' is a per-process cache, "
+        "each worker counts its own requests.",
+        hint="Point it at a cache shared by every worker, e.g. THROTTLING_CACHE_BACKEND=redis.",
+        id="users.W001",
+    )]
+
+
+# Only with `check --deploy`, the development server and the tests are one process
+@register(Tags.security, deploy=True)
+def check_revocation_cache(app_configs, **kwargs):
+    if not is_process_local_cache(settings.TOKEN_REVOCATION_CACHE_ALIAS):
+        return []
+
+    return [Error(
+        f"TOKEN_REVOCATION_CACHE_ALIAS '{settings.TOKEN_REVOCATION_CACHE_ALIAS}' is a per-process cache, "
+        "a token revoked or rotated on one worker is still accepted by the others.",
+        hint="Point it at a cache shared by every worker, e.g. CACHE_BACKEND=redis.",
+        id="users.E002",
+    )]
+
+
+@register(deploy=True)
+def check_role_registry_cache(app_configs, **kwargs):
+    # RoleService shares the role set's version through the default cache
+    if not is_process_local_cache("default"):
+        return []
+
+    return [Warning(
+        "The default cache is a per-process cache, a role added, renamed or deleted on one worker "
+        "is only seen by the others after a restart.",
+        hint="Point it at a cache shared by every worker, e.g. CACHE_BACKEND=redis.",
+        id="users.W004",
+    )]
+
+
+@register(deploy=True)
+def check_otp_cache(app_configs, **kwargs):
+    if not (
+        issubclass(import_string(settings.OTP_STORE_BACKEND), CacheOTPStore)
+        and is_process_local_cache(settings.OTP_CACHE_ALIAS)
+    ):
+        return []
+
+    return [Error(
+        f"OTP_STORE_BACKEND keeps codes in OTP_CACHE_ALIAS '{settings.OTP_CACHE_ALIAS}', a per-process cache, "
+        "a code issued on one worker fails verification on the others.",
+        hint="Point it at a cache shared by every worker, e.g. OTP_CACHE_BACKEND=redis, "
+             "or use users.services.DatabaseOTPStore.",
+        id="users.E005",
+    )]
+
+
+# Deploy only like E002, createcachetable has to run while a "db" alias is configured
+@register(deploy=True)
+def check_counter_caches(app_configs, **kwargs):
+    errors = []
+    # Throttle counters and refresh token claims rely on atomic add() and incr()
+    for setting_name in ("THROTTLE_CACHE_ALIAS", "TOKEN_REVOCATION_CACHE_ALIAS"):
+        alias = getattr(settings, setting_name)
+        if has_atomic_counters(alias):
+            continue
+
+        errors.append(Error(
+            f"{setting_name} '{alias}' uses {settings.CACHES[alias]['BACKEND'].rsplit('.', 1)[-1]}, "
+            "whose incr() is not atomic and resets the key's timeout.",
+            hint=f"Use the redis backend for '{alias}', or locmem for a single process.",
+            id="users.E003",
+        ))
+    return errors
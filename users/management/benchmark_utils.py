@@ -0,0 +1,107 @@
+import json
+import time
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.core.management import call_command
+
+from users.models import Role, User, UserProfile
+from users.services import RoleService, SideEffectService, get_otp_store, get_revocation_store, login_event_buffer
+
+ROLE_FIXTURE = Path(__file__).resolve().parents[1] / "fixtures" / "role.json"
+
+
+class ScratchDatabase:
+    """
+    Runs a benchmark against a new, migrated database, like the test runner
+    does, and caches under their own key prefix, so nothing it writes or
+    revokes reaches the configured ones. Dropped on exit unless `keep`.
+    """
+
+    def __init__(self, run_id, stdout, stderr, keep=False):
+        self.run_id = run_id
+        self.stdout = stdout
+        self.stderr = stderr
+        self.keep = keep
+        self.caches_override = override_settings(CACHES=self.get_caches())
+
+    def __enter__(self):
+        test_settings = connection.settings_dict["TEST"]
+        if connection.vendor == "sqlite":
+            test_settings["NAME"] = str(Path(tempfile.gettempdir()) / f"bench-{self.run_id}.sqlite3")
+        else:
+            test_settings["NAME"] = f"bench_{self.run_id}"
+
+        started = time.perf_counter()
+        self.old_config = setup_databases(verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set())
+        self.stdout.write(
+            f"Created the scratch database {connection.settings_dict['NAME']} in {time.perf_counter() - started:.1f} s"
+        )
+
+        self.caches_override.enable()
+        self.clear_stores()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Side effects and buffered login events of the last requests, written
+        # to the configured database and caches once switched back
+        if not SideEffectService.drain():
+            self.stderr.write("Side effects were still running when the scratch database was dropped")
+        login_event_buffer.flush()
+
+        self.caches_override.disable()
+        self.clear_stores()
+
+        if self.keep:
+            self.stdout.write(f"Kept the scratch database {connection.settings_dict['NAME']}")
+            return
+        connections.close_all()
+        teardown_databases(self.old_config, verbosity=0)
+
+    @staticmethod
+    def clear_stores():
+        # Built once per process and holding the cache they were built with
+        get_revocation_store.cache_clear()
+        get_otp_store.cache_clear()
+
+    def get_key_prefix(self):
+        return f"{settings.CACHE_KEY_PREFIX}:bench-{self.run_id}"
+
+    def get_caches(self):
+        # Shared caches would mix the scratch users' token versions and
+        # responses with those of the real users holding the same ids
+        return {
+            alias: {**cache_config, "KEY_PREFIX": f"{self.get_key_prefix()}:{alias}"}
+            for alias, cache_config in settings.CACHES.items()
+        }
+
+    def get_environment(self):
+        """Settings that point a started server at the scratch database and cache keys."""
+        environment = {"CACHE_KEY_PREFIX": self.get_key_prefix()}
+        if connection.vendor == "sqlite":
+            environment["SQLITE_PATH"] = str(connection.settings_dict["NAME"])
+        else:
+            # The replica has no copy of the scratch database
+            environment.update(DB_NAME=connection.settings_dict["NAME"], DB_REPLICA_HOST="")
+        return environment
+
+
+def load_roles():
+    """Loads the role fixture and returns the role new members get."""
+    fixture_roles = {entry["fields"]["name"] for entry in json.loads(ROLE_FIXTURE.read_text())}
+    # Only on an empty database, loading it elsewhere would rename roles sharing its ids
+    if not Role.objects.filter(name__in=fixture_roles).exists():
+        call_command("loaddata", str(ROLE_FIXTURE), verbosity=0)
+
+    return RoleService.get_user_role()
+
+
+def create_benchmark_user(email="bench@example.com"):
+    """An active member with a profile, as a verified registration leaves them."""
+    user = User.objects.create_user(email=email, username="bench", password=None, is_active=True)
+    UserProfile.objects.create(user=user, full_name="Bench Member", role=load_roles())
+    return user
@@ -0,0 +1,69 @@
+import time
+
+from django.db import transaction
+from django.utils.crypto import get_random_string
+from django.core.management.base import BaseCommand
+
+from common.db_utils import capture_queries
+from common.serializer_utils import update_nested_objects
+from users.models import User, LoginEvent
+
+
+def update_nested_objects_legacy(model_class, nested_data_list, extra_fields=None):
+    """update_nested_objects before the batched writes: one update_or_create or create per item."""
+    for item_data in nested_data_list:
+        item_data = {**item_data, **(extra_fields or {})}
+        if "id" in item_data:
+            item_id = item_data.pop("id")
+            model_class.objects.update_or_create(id=item_id, defaults=item_data)
+        else:
+            model_class.objects.create(**item_data)
+
+
+class Command(BaseCommand):
+    help = "Compare statements and time of the per-item and batched update_nested_objects on login events"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=1000, help="Nested items per payload")
+
+    def handle(self, *args, **options):
+        paths = {
+            "legacy": update_nested_objects_legacy,
+            "batched": update_nested_objects,
+        }
+
+        email = f"bench-nested-{get_random_string(6).lower()}@example.com"
+        user = User.objects.create_user(email=email, username="bench nested", password=None)
+        try:
+            self.stdout.write(f"{'path':<8} {'payload':<8} {'statements':>10} {'ms':>9}")
+            for name, update in paths.items():
+                for payload_name, statements, elapsed_ms in self.measure(user, update, options["items"]):
+                    self.stdout.write(f"{name:<8} {payload_name:<8} {statements:>10} {elapsed_ms:>9.1f}")
+        finally:
+            user.delete()
+
+    def measure(self, user, update, items):
+        extra_fields = {"user": user}
+        create_payload = [{"device": f"device {n}", "success": True} for n in range(items)]
+
+        results = [("create", *self.run(update, create_payload, extra_fields))]
+
+        # Ids as a JSON body would carry them from a form field, strings
+        ids = LoginEvent.objects.filter(user=user).values_list("id", flat=True)
+        update_payload = [{"id": str(event_id), "device": "renamed", "success": False} for event_id in ids]
+        results.append(("update", *self.run(update, update_payload, extra_fields)))
+
+        if LoginEvent.objects.filter(user=user).count() != items:
+            raise AssertionError("The update payload created rows instead of updating them")
+
+        LoginEvent.objects.filter(user=user).delete()
+        return results
+
+    def run(self, update, payload, extra_fields):
+        with capture_queries() as statements:
+            started = time.perf_counter()
+            with transaction.atomic():
+                update(LoginEvent, payload, extra_fields=extra_fields)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+        return len(statements), elapsed_ms
@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.core.management.base import BaseCommand
+
+from common.db_utils import capture_queries
+from users.models import User, OTP
+from users.services import DatabaseOTPStore
+
+
+def consume_legacy(email, otp):
+    """The verify path before the single UPDATE: user, OTP row, Python expiry check, full save()."""
+    user = User.objects.get(email=email)
+    otp_instance = OTP.objects.filter(user=user, otp=otp, used=False).order_by("-created_at").first()
+    if otp_instance is None or otp_instance.expire_at < timezone.now():
+        return None
+
+    otp_instance.used = True
+    otp_instance.save()
+    return user.pk, otp_instance.type
+
+
+class Command(BaseCommand):
+    help = "Compare round trips and throughput of the OTP verify paths"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verifications", type=int, default=500, help="Codes verified per path")
+
+    def handle(self, *args, **options):
+        store = DatabaseOTPStore()
+        paths = {
+            "legacy": consume_legacy,
+            "select_for_update": lambda email, otp: store.consume_locked(email, otp, timezone.now()),
+        }
+        if store.supports_update_returning():
+            paths["update_returning"] = lambda email, otp: store.consume_returning(email, otp, timezone.now())
+
+        email = f"bench-otp-{get_random_string(6).lower()}@example.com"
+        user = User.objects.create_user(email=email, username="bench otp", password=None)
+        try:
+            self.stdout.write(f"{'path':<18} {'queries/verify':>14} {'verifies/s':>11}")
+            for name, consume in paths.items():
+                verifies_per_second, queries = self.measure(user, consume, options["verifications"])
+                self.stdout.write(f"{name:<18} {queries:>14.2f} {verifies_per_second:>11.0f}")
+        finally:
+            user.delete()
+
+    def measure(self, user, consume, verifications):
+        expire_at = timezone.now() + timedelta(minutes=5)
+        codes = list(range(100000, 100000 + verifications))
+        OTP.objects.bulk_create([OTP(user=user, otp=code, type="sign_up", expire_at=expire_at) for code in codes])
+
+        with capture_queries() as queries:
+            started = time.perf_counter()
+            for code in codes:
+                consume(user.email, code)
+            elapsed = time.perf_counter() - started
+
+        OTP.objects.filter(user=user).delete()
+        return verifications / elapsed, len(queries) / verifications
@@ -0,0 +1,76 @@
+import math
+import time
+import multiprocessing
+
+from django.conf import settings
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+from django.core.management.base import BaseCommand
+
+from common.hashers import ConfiguredHasherMixin
+
+
+def measure_hasher(hasher_path, iterations):
+    """Seconds per encode() on this core, bypassing the hashing pool."""
+    hasher = import_string(hasher_path)()
+    encode = super(ConfiguredHasherMixin, hasher).encode
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        encode("correct horse battery staple", hasher.salt())
+    return (time.perf_counter() - started) / iterations
+
+
+class Command(BaseCommand):
+    help = "Report hashes per second per core for each PASSWORD_HASHER_PROFILES profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", nargs="+", choices=list(settings.PASSWORD_HASHER_PROFILES), help="Profiles to measure, all by default")
+        parser.add_argument("--iterations", type=int, default=10, help="Hashes per process and profile")
+        parser.add_argument("--processes", type=int, default=1, help="Processes hashing at once, to see how throughput scales")
+        parser.add_argument("--target-ms", type=float, help="Suggest work parameters for this latency per hash")
+
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        # Forking is safe here, the command holds no locks or connections worth keeping
+        pool = multiprocessing.get_context("fork").Pool(processes) if processes > 1 else None
+
+        self.stdout.write(f"{'profile':<8} {'ms/hash':>9} {'hashes/s/core':>14} {'hashes/s':>9}")
+        for profile in options["profiles"] or settings.PASSWORD_HASHER_PROFILES:
+            hasher_path = settings.PASSWORD_HASHER_PROFILES[profile]
+            hasher = import_string(hasher_path)()
+
+            if hasher.library:
+                try:
+                    hasher._load_library()
+                except ValueError as e:
+                    self.stdout.write(f"{profile:<8} skipped: {e}")
+                    continue
+
+            if pool:
+                seconds = pool.starmap(measure_hasher, [(hasher_path, options["iterations"])] * processes)
+            else:
+                seconds = [measure_hasher(hasher_path, options["iterations"])]
+
+            ms_per_hash = sum(seconds) / len(seconds) * 1000
+            per_core = 1000 / ms_per_hash
+            self.stdout.write(f"{profile:<8} {ms_per_hash:>9.1f} {per_core:>14.1f} {per_core * len(seconds):>9.1f}")
+
+            if options["target_ms"]:
+                self.stdout.write(f"         for {options['target_ms']:g} ms: {self.suggest(profile, ms_per_hash, options['target_ms'])}")
+
+        if pool:
+            pool.close()
+
+    def suggest(self, profile, ms_per_hash, target_ms):
+        # Hashing time grows linearly with each of these parameters
+        scale = target_ms / ms_per_hash
+
+        if profile == "pbkdf2":
+            return f"PASSWORD_PBKDF2_ITERATIONS={max(int(settings.PASSWORD_PBKDF2_ITERATIONS * scale), 1)}"
+        if profile == "scrypt":
+            work_factor = 2 ** max(int(math.log2(settings.PASSWORD_SCRYPT_WORK_FACTOR * scale)), 1)
+            return f"PASSWORD_SCRYPT_WORK_FACTOR={work_factor}"
+        if profile == "argon2":
+            return f"PASSWORD_ARGON2_TIME_COST={max(round(settings.PASSWORD_ARGON2_TIME_COST * scale), 1)}"
+        return "no suggestion"
@@ -0,0 +1,121 @@
+import time
+import statistics
+from contextlib import contextmanager
+
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.utils.crypto import get_random_string
+from django.core.management.base import BaseCommand, CommandError
+
+from common.perf_utils import timed, db_execute_timer
+from common.middleware import PerformanceMiddleware
+from users.serializers import CustomTokenObtainPairSerializer
+from users.management.benchmark_utils import ScratchDatabase, create_benchmark_user
+
+
+def stub_view(request):
+    with timed("db"):
+        pass
+    return HttpResponse()
+
+
+def stub_execute(sql, params, many, context):
+    pass
+
+
+@contextmanager
+def query_timer(installed):
+    """Runs the block with or without db_execute_timer on this thread's connection."""
+    connection.ensure_connection()
+    wrappers = connection.execute_wrappers
+    connection.execute_wrappers = [wrapper for wrapper in wrappers if wrapper is not db_execute_timer]
+    if installed:
+        connection.execute_wrappers.append(db_execute_timer)
+    try:
+        yield
+    finally:
+        connection.execute_wrappers = wrappers
+
+
+class Command(BaseCommand):
+    help = "Measure PerformanceMiddleware overhead: sampling off, requests left out of the sample, every request sampled"
+
+    # Sample rate and whether queries go through the timer. "off" is the
+    # default deploy (PERF_SAMPLE_RATE=0, no timer installed), "unsampled"
+    # is a request left out of the sample while sampling is on
+    MODES = {
+        "off": (0.0, False),
+        "unsampled": (0.0, True),
+        "sampled": (1.0, True),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per round")
+        parser.add_argument("--rounds", type=int, default=5, help="Alternating rounds per mode")
+
+    def handle(self, *args, **options):
+        with ScratchDatabase(get_random_string(6).lower(), self.stdout, self.stderr):
+            user = create_benchmark_user()
+            access_token = str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+            headers = {"Authorization": f"Bearer {access_token}"}
+
+            end_to_end = {mode: [] for mode in self.MODES}
+            isolated = {0.0: [], 1.0: []}
+            timer = {False: [], True: []}
+            # Alternate the modes so drift (caches, CPU frequency) hits all alike
+            for _ in range(options["rounds"]):
+                for mode, (sample_rate, timed_queries) in self.MODES.items():
+                    end_to_end[mode].append(self.measure_end_to_end(sample_rate, timed_queries, headers, options["requests"]))
+                for sample_rate in isolated:
+                    isolated[sample_rate].append(self.measure_isolated(sample_rate, options["requests"] * 10))
+                for installed in timer:
+                    timer[installed].append(self.measure_query_timer(installed, options["requests"] * 100))
+
+        # Whole requests vary by more than the middleware costs, the isolated
+        # runs measure the middleware alone around a stub view and the query
+        # timer alone around a stub execute
+        request_cost = min(end_to_end["off"])
+        middleware_cost = min(isolated[1.0]) - min(isolated[0.0])
+        timer_cost = min(timer[True]) - min(timer[False])
+
+        self.stdout.write("GET /users/me/ (best round, median round)")
+        for mode, samples in end_to_end.items():
+            self.stdout.write(f"  {mode:<10} {min(samples):.1f} us, {statistics.median(samples):.1f} us")
+        self.stdout.write(f"middleware cost per sampled request: {middleware_cost:.1f} us")
+        self.stdout.write(f"query timer cost per unsampled query: {timer_cost * 1000:.0f} ns")
+        self.stdout.write(f"overhead: {middleware_cost / request_cost * 100:.2f}% of GET /users/me/ with every request sampled")
+
+    def measure_end_to_end(self, sample_rate, timed_queries, headers, requests):
+        with override_settings(PERF_SAMPLE_RATE=sample_rate, PERF_SERVER_TIMING=True), query_timer(timed_queries):
+            # The middleware chain is built, and reads the settings, on the first request
+            client = Client(headers=headers)
+            response = client.get("/users/me/")
+            if response.status_code != 200:
+                raise CommandError(f"GET /users/me/ returned {response.status_code}")
+
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get("/users/me/")
+            return (time.perf_counter() - started) / requests * 1e6
+
+    def measure_isolated(self, sample_rate, requests):
+        with override_settings(PERF_SAMPLE_RATE=sample_rate, PERF_SERVER_TIMING=True):
+            middleware = PerformanceMiddleware(stub_view)
+
+        request = RequestFactory().get("/users/me/")
+        started = time.perf_counter()
+        for _ in range(requests):
+            middleware(request)
+        return (time.perf_counter() - started) / requests * 1e6
+
+    def measure_query_timer(self, installed, queries):
+        # Outside a sampled request, as for every query of an unsampled one
+        started = time.perf_counter()
+        if installed:
+            for _ in range(queries):
+                db_execute_timer(stub_execute, "SELECT 1", None, False, {})
+        else:
+            for _ in range(queries):
+                stub_execute("SELECT 1", None, False, {})
+        return (time.perf_counter() - started) / queries * 1e6
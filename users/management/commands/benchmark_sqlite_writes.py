@@ -0,0 +1,84 @@
+import os
+import time
+import sqlite3
+import tempfile
+from multiprocessing import Pool
+
+from django.db import connections, transaction
+from django.core.management.base import BaseCommand
+
+BENCH_ALIAS = "sqlite_bench"
+
+# "performance" mirrors the SQLITE_PERFORMANCE_PROFILE defaults in settings
+PROFILES = {
+    "default": {},
+    "performance": {
+        "transaction_mode": "IMMEDIATE",
+        "timeout": 5,
+        "init_command": (
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA busy_timeout=5000;"
+            "PRAGMA mmap_size=134217728;"
+            "PRAGMA cache_size=-20000;"
+        ),
+    },
+}
+
+
+def run_writer(args):
+    path, options, writes = args
+    # A throwaway alias so each profile gets its own connection options
+    connections.settings[BENCH_ALIAS] = connections.configure_settings({
+        "default": connections.settings["default"],
+        BENCH_ALIAS: {"ENGINE": "django.db.backends.sqlite3", "NAME": path, "OPTIONS": options},
+    })[BENCH_ALIAS]
+
+    succeeded = failed = 0
+    for i in range(writes):
+        try:
+            # Same shape as OTP issuing: read, delete the old code, insert the new one
+            with transaction.atomic(using=BENCH_ALIAS):
+                with connections[BENCH_ALIAS].cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM bench_otp WHERE user_id = %s", [os.getpid()])
+                    cursor.execute("DELETE FROM bench_otp WHERE user_id = %s AND used = 0", [os.getpid()])
+                    cursor.execute(
+                        "INSERT INTO bench_otp (user_id, otp, used) VALUES (%s, %s, 0)", [os.getpid(), i]
+                    )
+            succeeded += 1
+        except Exception:
+            failed += 1
+
+    connections[BENCH_ALIAS].close()
+    return succeeded, failed
+
+
+class Command(BaseCommand):
+    help = "Multi-process SQLite write throughput with and without SQLITE_PERFORMANCE_PROFILE settings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4)
+        parser.add_argument("--writes", type=int, default=250, help="Write transactions per process")
+
+    def handle(self, *args, **options):
+        for name, profile_options in PROFILES.items():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "bench.sqlite3")
+                with sqlite3.connect(path) as db:
+                    db.execute("CREATE TABLE bench_otp (id INTEGER PRIMARY KEY, user_id INTEGER, otp INTEGER, used INTEGER)")
+                    db.execute("CREATE INDEX bench_otp_user ON bench_otp (user_id, used)")
+
+                started = time.perf_counter()
+                with Pool(options["processes"]) as pool:
+                    results = pool.map(
+                        run_writer,
+                        [(path, profile_options, options["writes"])] * options["processes"],
+                    )
+                elapsed = time.perf_counter() - started
+
+            succeeded = sum(result[0] for result in results)
+            failed = sum(result[1] for result in results)
+            self.stdout.write(
+                f"{name:<12} {succeeded / elapsed:8.0f} writes/s, "
+                f"{succeeded} committed, {failed} failed (database is locked) in {elapsed:.2f}s"
+            )
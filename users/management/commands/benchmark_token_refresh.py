@@ -0,0 +1,51 @@
+import time
+from unittest import mock
+
+from django.test import Client
+from django.utils.crypto import get_random_string
+from rest_framework_simplejwt.settings import api_settings
+from django.core.management.base import BaseCommand, CommandError
+
+from common.db_utils import capture_queries
+from users.serializers import CustomTokenObtainPairSerializer
+from users.management.benchmark_utils import ScratchDatabase, create_benchmark_user
+
+
+class Command(BaseCommand):
+    help = "Measure POST /users/login/refresh/ throughput with refresh-token rotation off and on"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Refreshes per mode")
+
+    def handle(self, *args, **options):
+        # Rotation revokes every refreshed token, in the cache and written
+        # behind to RevokedToken, so never in the configured ones
+        with ScratchDatabase(get_random_string(6).lower(), self.stdout, self.stderr):
+            user = create_benchmark_user()
+
+            for rotate in (False, True):
+                # Patched in place, overriding SIMPLE_JWT rebinds simplejwt's api_settings
+                # while the serializers keep the instance they imported
+                with mock.patch.object(api_settings, "ROTATE_REFRESH_TOKENS", rotate):
+                    refreshes_per_second, queries = self.measure(user, options["requests"])
+                self.stdout.write(
+                    f"rotation {'on ' if rotate else 'off'}: {refreshes_per_second:.0f} refreshes/s, "
+                    f"{queries:.2f} request-path queries/refresh"
+                )
+
+    def measure(self, user, requests):
+        client = Client()
+        refresh = str(CustomTokenObtainPairSerializer.get_token(user))
+
+        # Write-behind inserts run on the side-effect pool and are not counted
+        with capture_queries() as queries:
+            started = time.perf_counter()
+            for _ in range(requests):
+                response = client.post("/users/login/refresh/", {"refresh": refresh}, content_type="application/json")
+                if response.status_code != 200:
+                    raise CommandError(f"Refresh returned {response.status_code}: {response.content[:200]}")
+                # A rotated token can't be used twice
+                refresh = response.json().get("refresh", refresh)
+            elapsed = time.perf_counter() - started
+
+        return requests / elapsed, len(queries) / requests
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.services import LoginService, parse_user_agent
+
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36 Edg/124.0.2478.51",
+    "Dart/3.3 (dart:io)",
+    "okhttp/4.12.0",
+    "GymTrainer/2.3.1 (iPhone; iOS 17.4; Scale/3.00)",
+    "PostmanRuntime/7.37.3",
+]
+
+
+class Command(BaseCommand):
+    help = "Compare per-call cost of uncached and cached user-agent parsing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=5000, help="Calls per measurement")
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        corpus = [USER_AGENTS[i % len(USER_AGENTS)] for i in range(iterations)]
+
+        started = time.perf_counter()
+        for user_agent_string in corpus:
+            user_agent = parse_user_agent(user_agent_string)
+            f"{user_agent.browser.family} on {user_agent.os.family}"
+        uncached = (time.perf_counter() - started) / iterations
+
+        LoginService._device_cache.clear()
+        started = time.perf_counter()
+        for user_agent_string in corpus:
+            LoginService.parse_device(user_agent_string)
+        cached = (time.perf_counter() - started) / iterations
+
+        self.stdout.write(f"uncached: {uncached * 1e6:.1f} us/call")
+        self.stdout.write(f"cached:   {cached * 1e6:.1f} us/call ({uncached / cached:.0f}x)")
+        self.stdout.write(f"cache:    {LoginService.get_device_cache_stats()}")
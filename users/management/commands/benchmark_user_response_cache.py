@@ -0,0 +1,42 @@
+import time
+
+from django.test import Client, override_settings
+from django.utils.crypto import get_random_string
+from django.core.management.base import BaseCommand, CommandError
+
+from common.db_utils import capture_queries
+from users.serializers import CustomTokenObtainPairSerializer
+from users.management.benchmark_utils import ScratchDatabase, create_benchmark_user
+
+
+class Command(BaseCommand):
+    help = "Measure GET /users/me/ polling throughput without the response cache, warm, and revalidated with If-None-Match"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per mode")
+
+    def handle(self, *args, **options):
+        # Cached responses and token versions stay out of the configured caches
+        with ScratchDatabase(get_random_string(6).lower(), self.stdout, self.stderr):
+            user = create_benchmark_user()
+            client = Client(HTTP_AUTHORIZATION=f"Bearer {CustomTokenObtainPairSerializer.get_token(user).access_token}")
+            etag = client.get("/users/me/")["ETag"]
+
+            with override_settings(USER_RESPONSE_CACHE_TIMEOUT=0):
+                self.report("uncached", *self.measure(client, options["requests"], 200))
+            self.report("warm cache", *self.measure(client, options["requests"], 200))
+            self.report("If-None-Match", *self.measure(client, options["requests"], 304, HTTP_IF_NONE_MATCH=etag))
+
+    def report(self, mode, requests_per_second, queries):
+        self.stdout.write(f"{mode:>14}: {requests_per_second:.0f} requests/s, {queries:.2f} queries/request")
+
+    def measure(self, client, requests, expected_status, **headers):
+        with capture_queries() as queries:
+            started = time.perf_counter()
+            for _ in range(requests):
+                response = client.get("/users/me/", **headers)
+                if response.status_code != expected_status:
+                    raise CommandError(f"GET /users/me/ returned {response.status_code}: {response.content[:200]}")
+            elapsed = time.perf_counter() - started
+
+        return requests / elapsed, len(queries) / requests
@@ -0,0 +1,419 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import multiprocessing
+from contextlib import nullcontext
+
+import django
+from django.conf import settings
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from common.db_utils import capture_queries
+from users.models import User, OutboundEmail
+from users.management.benchmark_utils import ScratchDatabase, load_roles
+
+PASSWORD = "Bench-pass-1234"
+NEW_PASSWORD = "Bench-pass-5678"
+
+OTP_PATTERN = re.compile(r"is: (\d+)\.")
+SERVER_TIMING_DB_PATTERN = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+# Arguments after `python -m <server>`, per server
+SERVERS = {
+    "gunicorn": lambda workers, port: [
+        "gym_trainer.wsgi", "--workers", str(workers), "--bind", f"127.0.0.1:{port}", "--log-level", "warning",
+    ],
+    # The app reads X-Forwarded-For itself through NUM_PROXIES, as it does under gunicorn
+    "uvicorn": lambda workers, port: [
+        "gym_trainer.asgi:application", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning", "--no-proxy-headers",
+    ],
+}
+
+
+class FlowError(Exception):
+    pass
+
+
+class ClientTransport:
+    """In-process requests through Django's test client, queries counted on this thread's connection."""
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data, headers, client_ip):
+        extra = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()}
+        extra["REMOTE_ADDR"] = client_ip
+        if method != "get":
+            extra["content_type"] = "application/json"
+
+        with capture_queries() as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, data, **extra)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+        body = response.json() if response.get("Content-Type") == "application/json" else {}
+        return response.status_code, body, elapsed_ms, len(queries)
+
+
+class HTTPTransport:
+    """
+    Requests to a running server. Query counts come from the Server-Timing
+    header, which needs PERF_SAMPLE_RATE=1 and PERF_SERVER_TIMING on the server.
+    The client IP is sent as X-Forwarded-For, as the one proxy the server
+    trusts with NUM_PROXIES=1.
+    """
+
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, data, headers, client_ip):
+        started = time.perf_counter()
+        response = self.session.request(
+            method.upper(), self.base_url + path, json=data, headers={**headers, "X-Forwarded-For": client_ip},
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        server_timing = response.headers.get("Server-Timing")
+        queries = None
+        if server_timing is not None:
+            match = SERVER_TIMING_DB_PATTERN.search(server_timing)
+            queries = int(match.group(1)) if match else 0
+
+        is_json = response.headers.get("Content-Type", "").startswith("application/json")
+        return response.status_code, response.json() if is_json else {}, elapsed_ms, queries
+
+
+def get_latest_otp(email):
+    # Queued mails are written in the request, whether or not the queue is drained
+    outbound_email = OutboundEmail.objects.filter(to_email=email).order_by("-id").first()
+    match = OTP_PATTERN.search(outbound_email.body) if outbound_email else None
+    if match is None:
+        raise FlowError(f"No OTP mail for {email}")
+    return match.group(1)
+
+
+def run_flow(transport, email, client_ip, role_id, use_async=False):
+    """
+    One user through register, verify-otp, login, refresh, me,
+    change-password and the reset-password flow. Returns a
+    (endpoint, status, ms, queries, error) sample per request, a user stops
+    at the first unexpected status. With `use_async` the endpoints that have
+    a variant under /users/async/ are called there.
+    """
+    samples = []
+    async_prefix = "/users/async" if use_async else "/users"
+
+    def call(endpoint, method, path, data=None, access=None, expected_status=200):
+        headers = {"Authorization": f"Bearer {access}"} if access else {}
+
+        # A distinct client IP per user, the login and OTP throttles are per IP
+        status, body, elapsed_ms, queries = transport.request(method, path, data, headers, client_ip)
+        error = f"{method.upper()} {path} returned {status}: {body}" if status != expected_status else None
+        samples.append((endpoint, status, elapsed_ms, queries, error))
+        if error:
+            raise FlowError(error)
+        return body
+
+    try:
+        call("register", "post", "/users/register/", {
+            "email": email, "password": PASSWORD, "full_name": email.split("@")[0], "role": role_id,
+        }, expected_status=201)
+        call("verify-otp", "post", f"{async_prefix}/verify-otp/", {"email": email, "otp": get_latest_otp(email)})
+
+        tokens = call("login", "post", "/users/login/", {"email": email, "password": PASSWORD})
+        tokens = {**tokens, **call("refresh", "post", "/users/login/refresh/", {"refresh": tokens["refresh"]})}
+
+        call("me", "get", f"{async_prefix}/me/", access=tokens["access"])
+        call("change-password", "patch", "/users/change-password/", {
+            "old_password": PASSWORD, "new_password": NEW_PASSWORD,
+        }, access=tokens["access"])
+
+        call("otp", "post", f"{async_prefix}/otp/", {"email": email})
+        reset_token = call("verify-otp", "post", f"{async_prefix}/verify-otp/", {
+            "email": email, "otp": get_latest_otp(email),
+        })["reset_token"]
+        call("reset-password", "post", f"{async_prefix}/reset-password/", {
+            "email": email, "reset_token": reset_token, "new_password": PASSWORD,
+        })
+    except FlowError:
+        pass
+
+    return samples
+
+
+def run_http_flows(base_url, users, role_id, use_async):
+    """Pool worker, runs its share of users one after another."""
+    transport = HTTPTransport(base_url)
+    samples = []
+    for email, client_ip in users:
+        samples.extend(run_flow(transport, email, client_ip, role_id, use_async))
+    connections.close_all()
+    return samples
+
+
+def get_percentile(sorted_values, percentile):
+    # Nearest rank
+    index = max(int(round(percentile / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def summarize(samples, wall_seconds, concurrency):
+    latencies = sorted(sample[2] for sample in samples)
+    queries = [sample[3] for sample in samples if sample[3] is not None]
+    errors = [sample[4] for sample in samples if sample[4]]
+    mean_ms = sum(latencies) / len(latencies)
+
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": round(get_percentile(latencies, 50), 2),
+        "p95_ms": round(get_percentile(latencies, 95), 2),
+        "p99_ms": round(get_percentile(latencies, 99), 2),
+        "mean_ms": round(mean_ms, 2),
+        # Per endpoint: what `concurrency` clients calling only it would reach
+        "requests_per_second": round(
+            len(samples) / wall_seconds if wall_seconds else 1000 / mean_ms * concurrency, 1
+        ),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the users API, sync or async views under gunicorn or uvicorn: seed users through fixtures, "
+        "drive register, verify-otp, login, refresh, me, change-password and reset-password, and report latency percentiles, "
+        "requests per second and queries per request per endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["client", "http"], default="client",
+                            help="Django test client in this process, or HTTP against a server")
+        parser.add_argument("--async", dest="use_async", action="store_true",
+                            help="Call the /users/async/ variants of otp, verify-otp, me and reset-password")
+        parser.add_argument("--server", choices=list(SERVERS), default="gunicorn",
+                            help="Server started in http mode: gunicorn (WSGI) or uvicorn (ASGI)")
+        parser.add_argument("--users", type=int, default=20, help="Users driven through the whole flow")
+        parser.add_argument("--seed", type=int, default=1000, help="Extra active users loaded before the run, so queries hit non-empty tables")
+        parser.add_argument("--processes", type=int, default=4, help="Client processes in http mode")
+        parser.add_argument("--url", help="Server for http mode, running with NUM_PROXIES=1. --server is started when omitted")
+        parser.add_argument("--workers", type=int, default=4, help="Workers of the started server")
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+        parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+        parser.add_argument("--keep", action="store_true", help="Keep the scratch database, or the benchmark users with --url")
+
+    def handle(self, *args, **options):
+        run_id = get_random_string(6).lower()
+        email_prefix = f"bench-{run_id}-"
+
+        # An external server works on its own database, everything else runs
+        # in a scratch one that is dropped afterwards
+        self.scratch = None if options["url"] else ScratchDatabase(run_id, self.stdout, self.stderr, options["keep"])
+        try:
+            with self.scratch or nullcontext():
+                samples, wall_seconds, concurrency = self.run(email_prefix, options)
+        finally:
+            if self.scratch is None and not options["keep"]:
+                User.objects.filter(email__startswith=email_prefix).delete()
+                OutboundEmail.objects.filter(to_email__startswith=email_prefix).delete()
+
+        if not samples:
+            raise CommandError("No requests were made")
+
+        report = self.build_report(samples, wall_seconds, concurrency, options)
+        self.print_report(report)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as fp:
+                self.print_comparison(report, json.load(fp))
+
+        if options["output"]:
+            with open(options["output"], "w") as fp:
+                json.dump(report, fp, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+    def run(self, email_prefix, options):
+        role_id = load_roles().pk
+        self.seed_users(email_prefix, options["seed"], role_id)
+
+        users = [
+            (f"{email_prefix}{i}@example.com", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+            for i in range(options["users"])
+        ]
+        if options["mode"] == "client":
+            return self.run_client(users, role_id, options["use_async"])
+        return self.run_http(users, role_id, options)
+
+    def seed_users(self, email_prefix, count, role_id):
+        if not count:
+            return
+
+        # One hash for every seeded user, they are never logged in
+        password = make_password(PASSWORD)
+        now = timezone.now().isoformat()
+        fixture = []
+        for i in range(count):
+            email = f"{email_prefix}seed-{i}@example.com"
+            fixture.append({"model": "users.user", "fields": {
+                "email": email, "username": f"seed {i}", "password": password, "is_active": True,
+                "created_at": now, "updated_at": now,
+            }})
+            fixture.append({"model": "users.userprofile", "fields": {
+                "user": [email], "full_name": f"Seed User {i}", "role": role_id,
+                "created_at": now, "updated_at": now,
+            }})
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fp:
+            json.dump(fixture, fp)
+        try:
+            started = time.perf_counter()
+            call_command("loaddata", fp.name, verbosity=0)
+            self.stdout.write(f"Seeded {count} users in {time.perf_counter() - started:.1f} s")
+        finally:
+            os.unlink(fp.name)
+
+    def run_client(self, users, role_id, use_async):
+        transport = ClientTransport()
+        samples = []
+
+        # Mails queued with EMAIL_QUEUE_ENABLED off are sent right away, keep them in memory
+        with override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"):
+            started = time.perf_counter()
+            for email, client_ip in users:
+                samples.extend(run_flow(transport, email, client_ip, role_id, use_async))
+            wall_seconds = time.perf_counter() - started
+
+        return samples, wall_seconds, 1
+
+    def run_http(self, users, role_id, options):
+        processes = options["processes"]
+        server = None if options["url"] else self.start_server(options["server"], options["workers"])
+        base_url = options["url"] or server.base_url
+
+        try:
+            shares = [users[i::processes] for i in range(processes)]
+            # Forked children open their own connections
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                started = time.perf_counter()
+                results = pool.starmap(run_http_flows, [
+                    (base_url, share, role_id, options["use_async"]) for share in shares if share
+                ])
+                wall_seconds = time.perf_counter() - started
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+        return [sample for result in results for sample in result], wall_seconds, processes
+
+    def start_server(self, name, workers):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "gym_trainer.settings"),
+            "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+            **self.scratch.get_environment(),
+            # This command is the proxy, its X-Forwarded-For carries each simulated client
+            "NUM_PROXIES": "1",
+            # Every response reports its query count in Server-Timing
+            "PERF_SAMPLE_RATE": "1",
+            "PERF_SERVER_TIMING": "True",
+        }
+        try:
+            server = subprocess.Popen(
+                [sys.executable, "-m", name, *SERVERS[name](workers, port)],
+                cwd=settings.BASE_DIR, env=env,
+            )
+        except OSError as e:
+            raise CommandError(f"Starting {name} failed: {e}")
+        server.base_url = f"http://127.0.0.1:{port}"
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"{name} exited on startup, is it installed? Or start a server and pass --url")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+
+        server.terminate()
+        raise CommandError(f"{name} didn't start listening within 30 s")
+
+    def build_report(self, samples, wall_seconds, concurrency, options):
+        by_endpoint = {}
+        for sample in samples:
+            by_endpoint.setdefault(sample[0], []).append(sample)
+
+        return {
+            "mode": options["mode"],
+            "server": options["url"] or options["server"] if options["mode"] == "http" else None,
+            "async": options["use_async"],
+            "users": options["users"],
+            "seed": options["seed"],
+            "concurrency": concurrency,
+            "created_at": timezone.now().isoformat(),
+            "environment": {
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "cache": settings.CACHES["default"]["BACKEND"],
+                "password_hasher_profile": settings.PASSWORD_HASHER_PROFILE,
+            },
+            "total": summarize(samples, wall_seconds, concurrency),
+            "endpoints": {
+                endpoint: summarize(endpoint_samples, None, concurrency)
+                for endpoint, endpoint_samples in by_endpoint.items()
+            },
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{'endpoint':<16} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'req/s':>8} {'queries':>8}"
+        )
+        for endpoint, stats in [*report["endpoints"].items(), ("total", report["total"])]:
+            queries = stats["queries_per_request"]
+            self.stdout.write(
+                f"{endpoint:<16} {stats['requests']:>8} {stats['errors']:>6} {stats['p50_ms']:>8.1f} "
+                f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['requests_per_second']:>8.1f} "
+                f"{'-' if queries is None else f'{queries:.2f}':>8}"
+            )
+
+        for endpoint, stats in report["endpoints"].items():
+            if stats["first_error"]:
+                self.stderr.write(f"{endpoint}: {stats['errors']} failed, first: {stats['first_error'][:300]}")
+
+    def print_comparison(self, report, baseline):
+        self.stdout.write("\nChange against the baseline (p95, req/s)")
+        for endpoint, stats in [*report["endpoints"].items(), ("total", report["total"])]:
+            previous = baseline["total"] if endpoint == "total" else baseline["endpoints"].get(endpoint)
+            if not previous:
+                continue
+
+            p95_change = (stats["p95_ms"] / previous["p95_ms"] - 1) * 100 if previous["p95_ms"] else 0
+            rps_change = (
+                (stats["requests_per_second"] / previous["requests_per_second"] - 1) * 100
+                if previous["requests_per_second"] else 0
+            )
+            self.stdout.write(f"{endpoint:<16} {p95_change:>+7.1f}% {rps_change:>+7.1f}%")
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+
+from common.db_utils import delete_in_chunks
+from users.models import LoginEvent
+
+
+class Command(BaseCommand):
+    help = "Delete login events older than the retention period in bounded chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.LOGIN_EVENT_RETENTION_DAYS, help="Keep events newer than this many days")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows deleted per statement")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between chunks")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        # Walks the created_at index oldest first
+        expired_events = LoginEvent.objects.filter(created_at__lt=cutoff).order_by("created_at")
+        total_deleted = delete_in_chunks(expired_events, options["chunk_size"], options["sleep"])
+
+        self.stdout.write(f"Deleted {total_deleted} login events")
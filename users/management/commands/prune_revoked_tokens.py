@@ -0,0 +1,19 @@
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+
+from common.db_utils import delete_in_chunks
+from users.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = "Delete revoked tokens that have expired anyway, in bounded chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows deleted per statement")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between chunks")
+
+    def handle(self, *args, **options):
+        expired_tokens = RevokedToken.objects.filter(expires_at__lt=timezone.now()).order_by("expires_at")
+        total_deleted = delete_in_chunks(expired_tokens, options["chunk_size"], options["sleep"])
+
+        self.stdout.write(f"Deleted {total_deleted} revoked tokens")
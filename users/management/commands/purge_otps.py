@@ -0,0 +1,20 @@
+from django.db.models import Q
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+
+from common.db_utils import delete_in_chunks
+from users.models import OTP
+
+
+class Command(BaseCommand):
+    help = "Delete expired and used OTPs in bounded chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows deleted per statement")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between chunks")
+
+    def handle(self, *args, **options):
+        stale_otps = OTP.objects.filter(Q(used=True) | Q(expire_at__lt=timezone.now()))
+        total_deleted = delete_in_chunks(stale_otps, options["chunk_size"], options["sleep"])
+
+        self.stdout.write(f"Deleted {total_deleted} OTPs")
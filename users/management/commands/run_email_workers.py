@@ -0,0 +1,63 @@
+import signal
+import threading
+
+from django.db import close_old_connections
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from users.services import EmailQueueService
+
+
+class Command(BaseCommand):
+    help = "Drain the outbound email queue with a pool of workers, each holding one SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Number of worker threads")
+        parser.add_argument("--batch-size", type=int, default=None, help="Emails claimed per batch")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit")
+
+    def handle(self, *args, **options):
+        self.stop_event = threading.Event()
+
+        if not options["once"]:
+            signal.signal(signal.SIGINT, lambda *_: self.stop_event.set())
+            signal.signal(signal.SIGTERM, lambda *_: self.stop_event.set())
+
+        threads = [
+            threading.Thread(target=self.work, args=(options,), name=f"email-worker-{i}", daemon=True)
+            for i in range(options["workers"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def work(self, options):
+        # A long-lived connection per worker, reopened lazily after failures
+        connection = get_connection()
+
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                batch = EmailQueueService.claim_batch(options["batch_size"])
+
+                if not batch:
+                    # Don't hold an idle SMTP session open while waiting
+                    connection.close()
+                    if options["once"]:
+                        break
+                    self.stop_event.wait(options["poll_interval"])
+                    continue
+
+                try:
+                    connection.open()
+                except Exception as e:
+                    # send_batch records the failure per email and schedules the retries
+                    self.stderr.write(f"Could not open mail connection: {e}")
+
+                sent_count = EmailQueueService.send_batch(batch, connection=connection)
+                self.stdout.write(f"{threading.current_thread().name}: sent {sent_count}/{len(batch)}")
+        finally:
+            connection.close()
+            close_old_connections()
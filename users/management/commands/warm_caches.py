@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.services import CacheWarmupService
+
+
+class Command(BaseCommand):
+    help = "Preload roles, email assets and the /users/me/ responses of recently active users, run once per deploy"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Most active users to preload, 0 skips them")
+        parser.add_argument("--days", type=int, default=7, help="Window for counting each user's logins")
+
+    def handle(self, *args, **options):
+        if settings.CACHES["default"]["BACKEND"] == settings.CACHE_BACKENDS["locmem"]:
+            self.stderr.write(self.style.WARNING(
+                "The default cache is per process, nothing warmed here reaches the web workers. "
+                "Use a shared CACHE_BACKEND, or WARM_CACHES_ON_STARTUP for the per-process caches."
+            ))
+
+        self.run_step("roles", CacheWarmupService.warm_roles)
+        self.run_step("email assets", CacheWarmupService.warm_email_assets)
+        if options["users"]:
+            self.run_step("users", CacheWarmupService.warm_users, options["users"], options["days"])
+
+    def run_step(self, name, warm, *args):
+        started = time.perf_counter()
+        count = warm(*args)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"{name}: {count} warmed in {elapsed_ms:.1f} ms")
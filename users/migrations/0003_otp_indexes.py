@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['user', 'type', 'used', 'expire_at'], name='users_otp_user_id_fa346c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['expire_at'], name='users_otp_expire__f1739f_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_manager'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoginEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('device', models.CharField(blank=True, max_length=255, null=True)),
+                ('location', models.CharField(blank=True, max_length=255, null=True)),
+                ('success', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at', '-id'], name='users_login_user_id_872d01_idx'), models.Index(fields=['created_at'], name='users_login_created_519563_idx')],
+            },
+        ),
+    ]
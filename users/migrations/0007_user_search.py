@@ -0,0 +1,90 @@
+# Search indexes behind users.services.UserSearchService. The schema depends
+# on the database vendor, so it is created here instead of in model Meta.
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+POSTGRESQL_FORWARDS = [
+    # Django compiles icontains to UPPER(column) LIKE UPPER(%s)
+    'CREATE INDEX users_user_email_trgm ON users_user USING gin (UPPER(email) gin_trgm_ops)',
+    'CREATE INDEX users_userprofile_full_name_trgm ON users_userprofile USING gin (UPPER(full_name) gin_trgm_ops)',
+]
+
+POSTGRESQL_BACKWARDS = [
+    'DROP INDEX IF EXISTS users_userprofile_full_name_trgm',
+    'DROP INDEX IF EXISTS users_user_email_trgm',
+]
+
+SQLITE_FORWARDS = [
+    # rowid is the user id, the trigram tokenizer indexes substrings
+    "CREATE VIRTUAL TABLE users_user_search USING fts5(email, full_name, tokenize='trigram')",
+    """
+    INSERT INTO users_user_search (rowid, email, full_name)
+    SELECT u.id, u.email, COALESCE(p.full_name, '')
+    FROM users_user u LEFT JOIN users_userprofile p ON p.user_id = u.id
+    """,
+    """
+    CREATE TRIGGER users_user_search_user_insert AFTER INSERT ON users_user BEGIN
+        INSERT INTO users_user_search (rowid, email, full_name) VALUES (new.id, new.email, '');
+    END
+    """,
+    """
+    CREATE TRIGGER users_user_search_user_update AFTER UPDATE OF email ON users_user BEGIN
+        UPDATE users_user_search SET email = new.email WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER users_user_search_user_delete AFTER DELETE ON users_user BEGIN
+        DELETE FROM users_user_search WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER users_user_search_profile_insert AFTER INSERT ON users_userprofile BEGIN
+        UPDATE users_user_search SET full_name = COALESCE(new.full_name, '') WHERE rowid = new.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER users_user_search_profile_update AFTER UPDATE OF full_name ON users_userprofile BEGIN
+        UPDATE users_user_search SET full_name = COALESCE(new.full_name, '') WHERE rowid = new.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER users_user_search_profile_delete AFTER DELETE ON users_userprofile BEGIN
+        UPDATE users_user_search SET full_name = '' WHERE rowid = old.user_id;
+    END
+    """,
+]
+
+SQLITE_BACKWARDS = [
+    'DROP TRIGGER IF EXISTS users_user_search_profile_delete',
+    'DROP TRIGGER IF EXISTS users_user_search_profile_update',
+    'DROP TRIGGER IF EXISTS users_user_search_profile_insert',
+    'DROP TRIGGER IF EXISTS users_user_search_user_delete',
+    'DROP TRIGGER IF EXISTS users_user_search_user_update',
+    'DROP TRIGGER IF EXISTS users_user_search_user_insert',
+    'DROP TABLE IF EXISTS users_user_search',
+]
+
+
+def run_statements(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_created_at_index'),
+    ]
+
+    operations = [
+        # A no-op on other databases
+        TrigramExtension(),
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRESQL_FORWARDS, 'sqlite': SQLITE_FORWARDS}),
+            run_statements({'postgresql': POSTGRESQL_BACKWARDS, 'sqlite': SQLITE_BACKWARDS}),
+        ),
+    ]
@@ -1,9 +1,17 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
 from django.contrib.postgres.fields import ArrayField
 from django.utils.translation import gettext_lazy as _
 
 # Create your models here.
+class UserManager(BaseUserManager):
+
+    def get_by_natural_key(self, username):
+        # Used by authenticate(), the login responses read the profile and role
+        return self.select_related("userprofile__role").get(**{self.model.USERNAME_FIELD: username})
+
 class User(AbstractUser):
     username = models.CharField(max_length=150, null=True, blank=True) 
     email = models.EmailField(_('email address'), unique=True)
@@ -13,6 +21,16 @@ class User(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ["username"]
 
+    objects = UserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Keyset pagination of the user directory, newest first
+            models.Index(fields=["-created_at", "-id"]),
+            # Case-insensitive email lookups of the bulk import
+            models.Index(Lower("email"), name="users_user_email_lower_idx"),
+        ]
+
     def __str__(self):
         return f"ID({self.pk}). " + self.email
     
@@ -45,6 +63,73 @@ class OTP(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "type", "used", "expire_at"]),
+            # Bulk purge of expired/used rows
+            models.Index(fields=["expire_at"]),
+        ]
+
     def __str__(self):
         return f"{self.user.email} | {self.otp} | {self.expire_at.time().strftime('%H:%M')}"
 
+class OutboundEmail(models.Model):
+    status_type = (
+        ("pending", "Pending"),
+        ("sending", "Sending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    )
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True, null=True)
+    images = models.JSONField(default=list, blank=True)
+    documents = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=status_type, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.UUIDField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} | {self.subject} | {self.status}"
+
+class LoginEvent(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
+    email = models.EmailField(blank=True, null=True)
+    ip = models.GenericIPAddressField(blank=True, null=True)
+    device = models.CharField(max_length=255, blank=True, null=True)
+    location = models.CharField(max_length=255, blank=True, null=True)
+    success = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Recent logins per user, newest first
+            models.Index(fields=["user", "-created_at", "-id"]),
+            # Retention pruning
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.email} | {self.ip} | {'success' if self.success else 'failed'}"
+
+
+class RevokedToken(models.Model):
+    """Durable copy of the token revocations kept in the cache."""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.jti} | {self.expires_at}"
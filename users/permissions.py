@@ -0,0 +1,26 @@
+from rest_framework.permissions import BasePermission
+
+from .services import RoleService
+
+
+class IsTrainerOrAdmin(BasePermission):
+    """
+    Staff users and users whose role is admin or trainer. A claims-only
+    request user is checked against the token's role claim, without a query.
+    """
+    allowed_roles = (RoleService.ADMIN, RoleService.TRAINER)
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not user or not user.is_authenticated:
+            return False
+        if user.is_staff:
+            return True
+
+        if getattr(user, "is_stateless", False):
+            role_name = user.token.get("role")
+        else:
+            profile = getattr(user, "userprofile", None)
+            role_name = profile.role.name if profile and profile.role else None
+
+        return role_name in self.allowed_roles
@@ -5,21 +5,46 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
 
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 
 from common.exception_utils import CustomAPIException
-from common.serializer_utils import get_serialized_or_none
+from common.serializer_utils import get_serialized_or_none, DynamicFieldsMixin
 
 from .models import (
-    User, UserProfile, OTP, Role
+    User, UserProfile, OTP, Role, LoginEvent
 )
-from .services import LoginService, RoleService, UserService, OTPService
+from .services import (
+    LoginService, RoleService, UserService, OTPService, TokenVersionService, TokenRevocationService,
+    UserResponseCacheService,
+)
+
+class AssignableRoleField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves the role id through the role registry instead of a query.
+    The admin role can't be self-assigned.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        try:
+            role = RoleService.get_role_by_id(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        if role is None or role.name == RoleService.ADMIN:
+            self.fail('does_not_exist', pk_value=data)
+        return role
 
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     full_name = serializers.CharField(required=True, write_only=True)
-    role = serializers.PrimaryKeyRelatedField(
-        queryset=Role.objects.exclude(id=RoleService.get_admin_role().id),
+    role = AssignableRoleField(
+        queryset=RoleService.get_assignable_roles(),
         write_only=True,
         required=True
     )
@@ -47,9 +72,13 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         
         # Add custom claims
         token['email'] = user.email
+        token['is_active'] = user.is_active
+        token['is_staff'] = user.is_staff
+        token['ver'] = TokenVersionService.get_version(user.id)
 
         if hasattr(user, 'userprofile'):
             token['full_name'] = user.userprofile.full_name
+            token['role'] = user.userprofile.role.name if user.userprofile.role else None
 
         return token
     
@@ -68,6 +97,49 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
         return data
 
+class RotatingTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh checked against TokenRevocationService instead of simplejwt's
+    blacklist app, which would add a write and a lookup per refresh. With
+    ROTATE_REFRESH_TOKENS a new refresh token is returned and the used one is
+    revoked, so it can't be replayed. The user row is only loaded when the
+    token's claims are stale, the new tokens then carry fresh claims.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        if TokenRevocationService.is_revoked(refresh):
+            raise TokenError("Token is revoked")
+
+        # Revoking is the atomic claim on the token, of concurrent refreshes
+        # with it only the one that revoked it gets new tokens
+        if api_settings.ROTATE_REFRESH_TOKENS and not TokenRevocationService.revoke(refresh):
+            raise TokenError("Token is revoked")
+
+        new_refresh = refresh
+        if not (refresh.get("is_active") and TokenVersionService.is_current(refresh)):
+            new_refresh = CustomTokenObtainPairSerializer.get_token(self.get_active_user(refresh))
+
+        data = {"access": str(new_refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if new_refresh is refresh:
+                new_refresh.set_jti()
+                new_refresh.set_exp()
+                new_refresh.set_iat()
+            data["refresh"] = str(new_refresh)
+
+        return data
+
+    def get_active_user(self, refresh):
+        user = User.objects.select_related('userprofile__role').filter(
+            **{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        return user
+
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
@@ -88,11 +160,11 @@ class VerifyOTPSerializer(serializers.Serializer):
     otp = serializers.IntegerField()
 
     def validate(self, data):
-        user, otp_type = OTPService.validate_otp(
+        user_id, otp_type = OTPService.consume_otp(
             email=data['email'],
             otp=data['otp'],
         )
-        return user, otp_type
+        return user_id, otp_type
 
 class ChangePasswordSerializer(serializers.Serializer):
     old_password = serializers.CharField()
@@ -108,6 +180,7 @@ class ChangePasswordSerializer(serializers.Serializer):
         user = self.context['request'].user
         user.set_password(self.validated_data['new_password'])
         user.save()
+        UserResponseCacheService.invalidate(user.pk)
 
 class RoleSerializer(serializers.ModelSerializer):
     class Meta:
@@ -127,7 +200,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
         return representation
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     profile = UserProfileSerializer(source='userprofile', required=False)
 
     class Meta:
@@ -138,6 +211,11 @@ class UserSerializer(serializers.ModelSerializer):
         # Update the user fields (email, etc.)
         return UserService.update_user(instance, validated_data)
 
+class LoginEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LoginEvent
+        fields = ('id', 'ip', 'device', 'location', 'success', 'created_at')
+
 class ForgetPasswordSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
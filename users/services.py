@@ -1,54 +1,208 @@
+import os
+import csv
+import time
+import atexit
+import copy
+import json
+import uuid
 import random
-import requests
+import hashlib
+import threading
+import mimetypes
+import ipaddress
+import logging
 
+import after_response
+from asgiref.sync import sync_to_async
 from user_agents import parse as parse_user_agent
+from rest_framework.settings import api_settings as drf_api_settings
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
 
 from datetime import timedelta
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 from email.mime.image import MIMEImage
 from email.mime.application import MIMEApplication
 
-from django.db import transaction
+from django.db import connection, transaction, close_old_connections, IntegrityError
+from django.db.models import Q, Count
+from django.db.models.functions import Lower
+from django.db.models.expressions import RawSQL
 from django.conf import settings
+from django.core.cache import cache, caches
 from django.utils import timezone
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from django.utils.html import strip_tags
-from django.core.mail import send_mail, EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
 from django.contrib.staticfiles import finders
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.tokens import default_token_generator
+from django.utils.module_loading import import_string
 
+from common.cache_utils import LRUCache, is_process_local_cache
 from common.exception_utils import CustomAPIException
+from common.geoip_utils import get_geoip_resolver
+from common.revocation_utils import RevocationStore
 
 from .models import (
-    Role, User, UserProfile, OTP,
+    Role, User, UserProfile, OTP, OutboundEmail, LoginEvent, RevokedToken,
 )
 
+logger = logging.getLogger(__name__)
+
+class SideEffectService:
+    """
+    Runs best-effort side effects (mail delivery, geo lookups, audit writes)
+    off the request path: after the surrounding transaction commits and, inside
+    a request, after the response went out (django-after-response). The work
+    runs on a bounded thread pool and failures are only logged.
+    """
+    _executor = ThreadPoolExecutor(max_workers=settings.SIDE_EFFECT_WORKERS, thread_name_prefix="side-effect")
+    _pending = threading.BoundedSemaphore(settings.SIDE_EFFECT_MAX_PENDING)
+    _request_state = threading.local()
+
+    @staticmethod
+    def defer(func, *args, **kwargs):
+        transaction.on_commit(lambda: SideEffectService.schedule(func, args, kwargs))
+
+    @staticmethod
+    def schedule(func, args, kwargs):
+        if getattr(SideEffectService._request_state, "active", False):
+            run_after_response.after_response(func, args, kwargs)
+        else:
+            # Management commands, shells and worker threads have no response to wait for
+            SideEffectService.submit(func, args, kwargs)
+
+    @staticmethod
+    def submit(func, args, kwargs):
+        if not SideEffectService._pending.acquire(blocking=False):
+            logger.error("Side effect %s dropped, %s tasks already pending", func.__qualname__, settings.SIDE_EFFECT_MAX_PENDING)
+            return
+
+        SideEffectService._executor.submit(SideEffectService.run, func, args, kwargs)
+
+    @staticmethod
+    def drain(timeout=30):
+        """
+        Waits until no side effect is pending, new ones are dropped meanwhile.
+        Returns False when some were still running after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        acquired = 0
+        try:
+            while acquired < settings.SIDE_EFFECT_MAX_PENDING:
+                if not SideEffectService._pending.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                    return False
+                acquired += 1
+            return True
+        finally:
+            for _ in range(acquired):
+                SideEffectService._pending.release()
+
+    @staticmethod
+    def run(func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Side effect %s failed", func.__qualname__)
+        finally:
+            SideEffectService._pending.release()
+            close_old_connections()
+
+    @staticmethod
+    def request_started(**kwargs):
+        SideEffectService._request_state.active = True
+
+    @staticmethod
+    def request_finished(**kwargs):
+        SideEffectService._request_state.active = False
+
+@after_response.enable
+def run_after_response(func, args, kwargs):
+    SideEffectService.submit(func, args, kwargs)
+
 class RoleService:
+    ADMIN = "admin"
+    USER = "user"
+    TRAINER = "trainer"
+
+    # Shared through the cache so every worker sees the same role set,
+    # mirrored in a process-local map checked against the shared version
+    VERSION_CACHE_KEY = "roles:version"
+    ROLES_CACHE_KEY = "roles:all"
+
+    _registry = {"version": None, "by_name": {}, "by_id": {}}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_registry():
+        version = cache.get(RoleService.VERSION_CACHE_KEY)
+        registry = RoleService._registry
+
+        if version is not None and registry["version"] == version:
+            return registry
+
+        with RoleService._lock:
+            cached = cache.get(RoleService.ROLES_CACHE_KEY)
+
+            if version is None or cached is None or cached["version"] != version:
+                version = uuid.uuid4().hex
+                cached = {"version": version, "roles": list(Role.objects.all())}
+                cache.set(RoleService.ROLES_CACHE_KEY, cached, None)
+                cache.set(RoleService.VERSION_CACHE_KEY, version, None)
+
+            RoleService._registry = {
+                "version": cached["version"],
+                "by_name": {role.name: role for role in cached["roles"]},
+                "by_id": {role.id: role for role in cached["roles"]},
+            }
+            return RoleService._registry
+
+    @staticmethod
+    def invalidate():
+        cache.delete_many([RoleService.VERSION_CACHE_KEY, RoleService.ROLES_CACHE_KEY])
+        RoleService._registry = {"version": None, "by_name": {}, "by_id": {}}
+
+    @staticmethod
+    def get_role(name):
+        role = RoleService.get_registry()["by_name"].get(name)
+
+        if role is None:
+            # Only on a fresh database, the post_save signal invalidates the registry
+            role, created = Role.objects.get_or_create(
+                name=name,
+                defaults={"name": name}
+            )
+        return role
+
+    @staticmethod
+    def get_role_by_name(name):
+        return RoleService.get_registry()["by_name"].get(name)
+
+    @staticmethod
+    def get_role_by_id(role_id):
+        return RoleService.get_registry()["by_id"].get(role_id)
+
+    @staticmethod
+    def get_assignable_roles():
+        # Lazy queryset, safe to build at import time
+        return Role.objects.exclude(name=RoleService.ADMIN)
 
     @staticmethod
     def get_admin_role():
-        admin_role, created = Role.objects.get_or_create(
-            name="admin", 
-            defaults={"name": "admin"}
-        )
-        return admin_role
+        return RoleService.get_role(RoleService.ADMIN)
     
     @staticmethod
     def get_user_role():
-        user_role, created = Role.objects.get_or_create(
-            name="user", 
-            defaults={"name": "user"}
-        )
-        return user_role
+        return RoleService.get_role(RoleService.USER)
     
     @staticmethod
     def get_trainer_role():
-        trainer_role, created = Role.objects.get_or_create(
-            name="trainer", 
-            defaults={"name": "trainer"}
-        )
-        return trainer_role
+        return RoleService.get_role(RoleService.TRAINER)
 
 class UserService:
 
@@ -118,6 +272,7 @@ class UserService:
                     
                     profile_serializer.save()
 
+                UserResponseCacheService.invalidate(instance.pk)
                 return instance
 
         except Exception as e:
@@ -133,59 +288,578 @@ class UserService:
         if not default_token_generator.check_token(user, token):
             raise CustomAPIException("Invalid or expired token.")
 
-class OTPService:
-    OTP_EXPIRY_MINUTES = 5
+class UserSearchService:
+    """
+    Substring search over user emails and profile full names.
+
+    PostgreSQL uses the pg_trgm GIN indexes and SQLite the users_user_search
+    FTS5 table kept in sync by triggers, both created in migration
+    0007_user_search. Terms shorter than a trigram fall back to a prefix match.
+    """
+    MIN_TRIGRAM_LENGTH = 3
 
     @staticmethod
-    def generate_otp():
-        return random.randint(100000, 999999)
+    def get_filter(term, user_lookup="pk"):
+        """Q object matching rows whose `user_lookup` points to a matching user."""
+        term = term.strip()
+        if not term:
+            return Q()
+
+        if len(term) < UserSearchService.MIN_TRIGRAM_LENGTH:
+            return (
+                Q(**{f"{user_lookup}__in": User.objects.filter(email__istartswith=term).values("pk")})
+                | Q(**{f"{user_lookup}__in": UserProfile.objects.filter(full_name__istartswith=term).values("user_id")})
+            )
+
+        if connection.vendor == "sqlite":
+            # Quoted as one FTS5 string, the trigram tokenizer matches it as a substring
+            match = '"' + term.replace('"', '""') + '"'
+            return Q(**{f"{user_lookup}__in": RawSQL(
+                "SELECT rowid FROM users_user_search WHERE users_user_search MATCH %s", [match]
+            )})
+
+        # One subquery per table, each can use its own trigram index
+        return (
+            Q(**{f"{user_lookup}__in": User.objects.filter(email__icontains=term).values("pk")})
+            | Q(**{f"{user_lookup}__in": UserProfile.objects.filter(full_name__icontains=term).values("user_id")})
+        )
 
     @staticmethod
-    def create_otp(user, otp_type: str):
+    def search(term, queryset=None):
+        queryset = queryset if queryset is not None else User.objects.all()
+        return queryset.filter(UserSearchService.get_filter(term))
+
+
+class DatabaseOTPStore:
+    """
+    OTPs stored as OTP rows, the default store. A code is matched and
+    consumed by a single conditional UPDATE.
+    """
+
+    def issue(self, user, otp_type, otp_code, expire_at):
         # Invalidate existing unused OTPs of the same type
         OTP.objects.filter(user=user, type=otp_type, used=False).delete()
 
-        otp_code = OTPService.generate_otp()
-        expire_time = timezone.now() + timedelta(minutes=OTPService.OTP_EXPIRY_MINUTES)
-
         OTP.objects.create(
             user=user,
             otp=otp_code,
             type=otp_type,
-            expire_at=expire_time
+            expire_at=expire_at
+        )
+
+    def consume(self, email, otp):
+        now = timezone.now()
+
+        if self.supports_update_returning():
+            consumed = self.consume_returning(email, otp, now)
+        else:
+            consumed = self.consume_locked(email, otp, now)
+
+        if consumed is None:
+            self.raise_consume_error(email, otp)
+        return consumed
+
+    @staticmethod
+    def supports_update_returning():
+        # can_return_columns_from_insert is about INSERT, MariaDB has that
+        # but no UPDATE ... RETURNING. SQLite added both in 3.35.
+        if connection.vendor == "postgresql":
+            return True
+        return connection.vendor == "sqlite" and connection.Database.sqlite_version_info >= (3, 35)
+
+    def consume_returning(self, email, otp, now):
+        # Match and consume in one statement. The outer "used" check makes a
+        # concurrent verification of the same code update nothing.
+        sql = f"""
+            UPDATE {OTP._meta.db_table} SET used = %s, updated_at = %s
+            WHERE id = (
+                SELECT o.id FROM {OTP._meta.db_table} o
+                INNER JOIN {User._meta.db_table} u ON u.id = o.user_id
+                WHERE u.email = %s AND o.otp = %s AND o.used = %s AND o.expire_at >= %s
+                ORDER BY o.created_at DESC, o.id DESC
+                LIMIT 1
+            ) AND used = %s
+            RETURNING user_id, type
+        """
+        now = connection.ops.adapt_datetimefield_value(now)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [True, now, email, otp, False, now, False])
+            row = cursor.fetchone()
+
+        return tuple(row) if row else None
+
+    def consume_locked(self, email, otp, now):
+        with transaction.atomic():
+            otp_instance = OTP.objects.select_for_update(
+                skip_locked=connection.features.has_select_for_update_skip_locked
+            ).filter(
+                user__email=email, otp=otp, used=False, expire_at__gte=now
+            ).order_by("-created_at", "-id").only("id", "user_id", "type").first()
+
+            if not otp_instance:
+                return None
+
+            OTP.objects.filter(id=otp_instance.id).update(used=True, updated_at=now)
+            return otp_instance.user_id, otp_instance.type
+
+    def raise_consume_error(self, email, otp):
+        # Failure path only, tells the client why the code was rejected
+        if not User.objects.filter(email=email).exists():
+            raise CustomAPIException("User not found")
+        if OTP.objects.filter(user__email=email, otp=otp, used=False).exists():
+            raise CustomAPIException("OTP expired")
+        raise CustomAPIException("Invalid OTP")
+
+    async def aissue(self, user, otp_type, otp_code, expire_at):
+        await OTP.objects.filter(user=user, type=otp_type, used=False).adelete()
+
+        await OTP.objects.acreate(
+            user=user,
+            otp=otp_code,
+            type=otp_type,
+            expire_at=expire_at
         )
 
+    async def aconsume(self, email, otp):
+        now = timezone.now()
+
+        otp_instance = await OTP.objects.filter(
+            user__email=email, otp=otp, used=False, expire_at__gte=now
+        ).order_by("-created_at", "-id").only("id", "user_id", "type").afirst()
+
+        # The conditional update is the consume, a concurrent request that
+        # found the same row updates nothing
+        if otp_instance and await OTP.objects.filter(
+            id=otp_instance.id, used=False
+        ).aupdate(used=True, updated_at=now):
+            return otp_instance.user_id, otp_instance.type
+
+        if not await User.objects.filter(email=email).aexists():
+            raise CustomAPIException("User not found")
+        if not otp_instance and await OTP.objects.filter(user__email=email, otp=otp, used=False).aexists():
+            raise CustomAPIException("OTP expired")
+        raise CustomAPIException("Invalid OTP")
+
+class CacheOTPStore:
+    """
+    Live OTPs kept in the OTP_CACHE_ALIAS cache with a native TTL, verifying
+    a code deletes its key and never writes to the database.
+    """
+
+    def __init__(self):
+        self.cache = caches[settings.OTP_CACHE_ALIAS]
+
+    @staticmethod
+    def get_code_key(email, otp):
+        return f"otp:{email}:{otp}"
+
+    @staticmethod
+    def get_current_key(email, otp_type):
+        return f"otp:{email}:{otp_type}:current"
+
+    def issue(self, user, otp_type, otp_code, expire_at):
+        timeout = max(int((expire_at - timezone.now()).total_seconds()), 1)
+        current_key = self.get_current_key(user.email, otp_type)
+
+        # Invalidate the previous unused OTP of the same type
+        previous_code = self.cache.get(current_key)
+        if previous_code is not None:
+            self.cache.delete(self.get_code_key(user.email, previous_code))
+
+        self.cache.set_many({
+            self.get_code_key(user.email, otp_code): {"user_id": user.pk, "type": otp_type},
+            current_key: otp_code,
+        }, timeout)
+
+    def consume(self, email, otp):
+        code_key = self.get_code_key(email, otp)
+        entry = self.cache.get(code_key)
+
+        # Expired codes are gone from the cache, and only the caller whose
+        # delete removed the key may use the code
+        if entry is None or not self.cache.delete(code_key):
+            raise CustomAPIException("Invalid OTP")
+
+        return entry["user_id"], entry["type"]
+
+    async def aissue(self, user, otp_type, otp_code, expire_at):
+        timeout = max(int((expire_at - timezone.now()).total_seconds()), 1)
+        current_key = self.get_current_key(user.email, otp_type)
+
+        previous_code = await self.cache.aget(current_key)
+        if previous_code is not None:
+            await self.cache.adelete(self.get_code_key(user.email, previous_code))
+
+        await self.cache.aset_many({
+            self.get_code_key(user.email, otp_code): {"user_id": user.pk, "type": otp_type},
+            current_key: otp_code,
+        }, timeout)
+
+    async def aconsume(self, email, otp):
+        code_key = self.get_code_key(email, otp)
+        entry = await self.cache.aget(code_key)
+
+        if entry is None or not await self.cache.adelete(code_key):
+            raise CustomAPIException("Invalid OTP")
+
+        return entry["user_id"], entry["type"]
+
+@lru_cache(maxsize=None)
+def get_otp_store():
+    return import_string(settings.OTP_STORE_BACKEND)()
+
+class UserImportService:
+    """
+    Bulk version of UserService.create_inactive_user for member lists.
+    Rows are streamed from CSV or JSON Lines and written chunk by chunk,
+    invalid rows are reported without aborting the import.
+    """
+    FORMATS = ("csv", "jsonl")
+    # Streams are opened with it, bytes that aren't UTF-8 become lone
+    # surrogates instead of failing the whole read
+    DECODE_ERRORS = "surrogateescape"
+
+    @staticmethod
+    def is_decoded(*values):
+        try:
+            for value in values:
+                if isinstance(value, str):
+                    value.encode("utf-8")
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    @staticmethod
+    def read_rows(stream, file_format):
+        invalid = ValueError("Line is not valid UTF-8")
+        if file_format == "csv":
+            for line_number, row in enumerate(csv.DictReader(stream), start=2):
+                if not UserImportService.is_decoded(*row, *row.values()):
+                    row = invalid
+                yield line_number, row
+        elif file_format == "jsonl":
+            for line_number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                if not UserImportService.is_decoded(line):
+                    yield line_number, invalid
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, e
+        else:
+            raise CustomAPIException(f"Unsupported format, use one of: {', '.join(UserImportService.FORMATS)}")
+
+    @staticmethod
+    def import_users(stream, file_format, chunk_size=1000):
+        report = {"created": 0, "updated": 0, "errors": []}
+        # Every imported user gets the same unusable hash, computed once
+        password = make_password(None)
+
+        chunk = []
+        for row in UserImportService.read_rows(stream, file_format):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                UserImportService.import_chunk(chunk, password, report)
+                chunk = []
+        if chunk:
+            UserImportService.import_chunk(chunk, password, report)
+
+        return report
+
+    @staticmethod
+    def clean_row(row):
+        if not isinstance(row, dict):
+            raise ValueError(f"Invalid row: {row}")
+
+        # Like create_user, only the domain is case-insensitive
+        email = User.objects.normalize_email((row.get("email") or "").strip())
+        validate_email(email)
+
+        role = RoleService.get_role_by_name(row.get("role") or RoleService.USER)
+        if role is None or role.name == RoleService.ADMIN:
+            raise ValueError(f"Invalid role: {row.get('role')}")
+
+        return email, {"full_name": (row.get("full_name") or "").strip() or None, "role": role}
+
+    @staticmethod
+    def import_chunk(chunk, password, report):
+        rows = {}
+        seen_emails = set()
+        for line_number, row in chunk:
+            try:
+                email, profile_data = UserImportService.clean_row(row)
+            except (ValueError, ValidationError) as e:
+                report["errors"].append({"line": line_number, "error": " ".join(getattr(e, "messages", [str(e)]))})
+                continue
+
+            if email.lower() in seen_emails:
+                report["errors"].append({"line": line_number, "error": f"Duplicate email in file: {email}"})
+                continue
+            seen_emails.add(email.lower())
+            rows[email] = profile_data
+
+        if not rows:
+            return
+
+        now = timezone.now()
+
+        with transaction.atomic():
+            # Matched case-insensitively, a row cased differently from the stored
+            # address updates that user instead of creating a second one
+            existing_emails = dict(User.objects.annotate(email_lower=Lower("email")).filter(
+                email_lower__in=seen_emails,
+            ).values_list("email_lower", "email"))
+            rows = {existing_emails.get(email.lower(), email): profile_data for email, profile_data in rows.items()}
+
+            User.objects.bulk_create([
+                User(
+                    email=email,
+                    username=profile_data["full_name"],
+                    password=password,
+                    is_active=False,
+                )
+                for email, profile_data in rows.items() if email.lower() not in existing_emails
+            ], ignore_conflicts=True)
+
+            # Re-read the ids, not every backend returns them from bulk_create
+            user_ids = dict(User.objects.filter(email__in=rows).values_list("email", "id"))
+            profiles = {
+                profile.user_id: profile
+                for profile in UserProfile.objects.filter(user_id__in=user_ids.values())
+            }
+
+            new_profiles = []
+            for email, profile_data in rows.items():
+                profile = profiles.get(user_ids[email])
+                if profile is None:
+                    new_profiles.append(UserProfile(user_id=user_ids[email], **profile_data))
+                else:
+                    profile.full_name = profile_data["full_name"]
+                    profile.role = profile_data["role"]
+                    # bulk_update skips auto_now
+                    profile.updated_at = now
+
+            UserProfile.objects.bulk_create(new_profiles)
+            UserProfile.objects.bulk_update(list(profiles.values()), ["full_name", "role", "updated_at"])
+
+        # Bulk writes send no save signals, refresh the token claims ourselves
+        TokenVersionService.bump_many(profiles.keys())
+
+        report["created"] += len(rows) - len(existing_emails)
+        report["updated"] += len(existing_emails)
+
+class TokenVersionService:
+    """
+    Per-user version stamp embedded in tokens as the `ver` claim. Any change
+    to the user or profile replaces it, which marks the claims of tokens
+    issued before as stale.
+    """
+
+    @staticmethod
+    def get_cache_key(user_id):
+        return f"token_version:{user_id}"
+
+    @staticmethod
+    def get_version(user_id):
+        key = TokenVersionService.get_cache_key(user_id)
+        version = cache.get(key)
+
+        if version is None:
+            version = uuid.uuid4().hex[:12]
+            # Another worker may have won the race, use whatever is stored
+            if not cache.add(key, version, None):
+                version = cache.get(key)
+        return version
+
+    @staticmethod
+    def bump(user_id):
+        cache.set(TokenVersionService.get_cache_key(user_id), uuid.uuid4().hex[:12], None)
+
+    @staticmethod
+    def bump_many(user_ids):
+        cache.set_many({
+            TokenVersionService.get_cache_key(user_id): uuid.uuid4().hex[:12]
+            for user_id in user_ids
+        }, None)
+
+    @staticmethod
+    def is_current(token):
+        # A bump only reaches the process that made it when every worker keeps
+        # its own cache, the others would trust stale claims
+        if is_process_local_cache("default"):
+            return False
+
+        # A missing (evicted) version counts as stale
+        version = cache.get(TokenVersionService.get_cache_key(token.get("user_id")))
+        return version is not None and version == token.get("ver")
+
+class UserResponseCacheService:
+    """
+    Serialized `/users/me/` responses kept per user in the cache, valid for
+    one TokenVersionService version. The version changes on every User,
+    UserProfile and Role save, so it doubles as the response's ETag.
+    """
+
+    @staticmethod
+    def get_cache_key(user_id):
+        return f"user_response:{user_id}"
+
+    @staticmethod
+    def get(user_id, version):
+        if not settings.USER_RESPONSE_CACHE_TIMEOUT:
+            return None
+
+        entry = cache.get(UserResponseCacheService.get_cache_key(user_id))
+        if entry is None or entry["version"] != version:
+            return None
+        return entry
+
+    @staticmethod
+    def get_last_modified(user):
+        profile = getattr(user, "userprofile", None)
+        timestamps = [user.updated_at]
+        if profile is not None:
+            timestamps.append(profile.updated_at)
+            if profile.role is not None:
+                timestamps.append(profile.role.updated_at)
+        return int(max(timestamps).timestamp())
+
+    @staticmethod
+    def fill(user, version, data=None):
+        """Caches the response of a user loaded with its profile and role, and returns it."""
+        from .serializers import UserSerializer
+
+        entry = {
+            "version": version,
+            "data": data if data is not None else UserSerializer(user).data,
+            "last_modified": UserResponseCacheService.get_last_modified(user),
+        }
+        if settings.USER_RESPONSE_CACHE_TIMEOUT:
+            cache.set(UserResponseCacheService.get_cache_key(user.pk), entry, settings.USER_RESPONSE_CACHE_TIMEOUT)
+        return entry
+
+    @staticmethod
+    def invalidate(user_id):
+        # Bumped again once committed, a response cached from the old rows
+        # while the transaction was open would otherwise keep the new version
+        transaction.on_commit(lambda: TokenVersionService.bump(user_id))
+
+@lru_cache(maxsize=None)
+def get_revocation_store():
+    jwt_settings = settings.SIMPLE_JWT
+    max_ttl = max(jwt_settings["ACCESS_TOKEN_LIFETIME"], jwt_settings["REFRESH_TOKEN_LIFETIME"]).total_seconds()
+    write_behind = settings.TOKEN_REVOCATION_DB_WRITE_BEHIND
+
+    return RevocationStore(
+        caches[settings.TOKEN_REVOCATION_CACHE_ALIAS],
+        max_ttl=max_ttl,
+        capacity=settings.TOKEN_REVOCATION_BLOOM_CAPACITY,
+        error_rate=settings.TOKEN_REVOCATION_BLOOM_ERROR_RATE,
+        sync_interval=settings.TOKEN_REVOCATION_SYNC_INTERVAL,
+        fallback=TokenRevocationService.is_revoked_in_db if write_behind else None,
+        backfill=TokenRevocationService.get_revoked_in_db if write_behind else None,
+    )
+
+
+class TokenRevocationService:
+    """
+    Revoked token ids (the `jti` claim) in a RevocationStore on the
+    TOKEN_REVOCATION_CACHE_ALIAS cache. With TOKEN_REVOCATION_DB_WRITE_BEHIND
+    every revocation is also written to RevokedToken after the response,
+    which is only read when the cache lost an entry or the log may be missing
+    some (see RevocationStore).
+    """
+
+    @staticmethod
+    def revoke(token):
+        """Returns False when the token was already revoked, by this or a concurrent request."""
+        jti = token[api_settings.JTI_CLAIM]
+        expires_at = datetime_from_epoch(token["exp"])
+
+        if not get_revocation_store().revoke(jti, (expires_at - timezone.now()).total_seconds()):
+            return False
+
+        if settings.TOKEN_REVOCATION_DB_WRITE_BEHIND:
+            SideEffectService.defer(
+                RevokedToken.objects.bulk_create,
+                [RevokedToken(jti=jti, expires_at=expires_at)],
+                ignore_conflicts=True,
+            )
+        return True
+
+    @staticmethod
+    def is_revoked(token):
+        return get_revocation_store().is_revoked(token[api_settings.JTI_CLAIM])
+
+    @staticmethod
+    def is_revoked_in_db(jti):
+        return RevokedToken.objects.filter(jti=jti, expires_at__gt=timezone.now()).exists()
+
+    @staticmethod
+    def get_revoked_in_db():
+        return RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list("jti", flat=True).iterator()
+
+
+class OTPService:
+    OTP_EXPIRY_MINUTES = 5
+
+    @staticmethod
+    def generate_otp():
+        return random.randint(100000, 999999)
+
+    @staticmethod
+    def create_otp(user, otp_type: str):
+        otp_code = OTPService.generate_otp()
+        expire_time = timezone.now() + timedelta(minutes=OTPService.OTP_EXPIRY_MINUTES)
+
+        get_otp_store().issue(user, otp_type, otp_code, expire_time)
+
         return (otp_code, OTPService.OTP_EXPIRY_MINUTES)
     
+    @staticmethod
+    async def acreate_otp(user, otp_type: str):
+        otp_code = OTPService.generate_otp()
+        expire_time = timezone.now() + timedelta(minutes=OTPService.OTP_EXPIRY_MINUTES)
+
+        await get_otp_store().aissue(user, otp_type, otp_code, expire_time)
+
+        return (otp_code, OTPService.OTP_EXPIRY_MINUTES)
+
+    @staticmethod
+    async def aconsume_otp(email: str, otp: int):
+        return await get_otp_store().aconsume(email, otp)
+
+    @staticmethod
+    def consume_otp(email: str, otp: int):
+        """Marks the code used and returns (user_id, otp_type), without loading the user."""
+        return get_otp_store().consume(email, otp)
+
     @staticmethod
     def validate_otp(email: str, otp: int):
+        user_id, otp_type = OTPService.consume_otp(email, otp)
+
         try:
-            user = User.objects.get(email=email)
+            user = User.objects.get(pk=user_id)
         except User.DoesNotExist:
             raise CustomAPIException("User not found")
 
-        otp_instance = OTP.objects.filter(
-            user=user, otp=otp, used=False
-        ).last()
-
-        if not otp_instance:
-            raise CustomAPIException("Invalid OTP")
-        if otp_instance.expire_at < timezone.now():
-            raise CustomAPIException("OTP expired")
-
-        otp_instance.used = True
-        otp_instance.save()
-        return user, otp_instance.type
+        return user, otp_type
 
 class EmailService:
+    # Inline image of the HTML mails, and their templates preloaded by CacheWarmupService
+    LOGO_IMAGE = ('gym-logo.webp', 'image1')
+    HTML_TEMPLATES = ("users/register_email.html", "users/forget_password_email.html")
+
     @staticmethod
     def send_otp_email(to_email, otp, expire_minutes):
         subject = 'Your OTP Code'
         message = f'Your One-Time Password (OTP) is: {otp}. It will expire in {expire_minutes} minutes.'
-        from_email = settings.DEFAULT_FROM_EMAIL
 
         try:
-            send_mail(subject, message, from_email, [to_email])
+            EmailQueueService.enqueue(subject, message, to_email)
         except Exception as e:
             raise CustomAPIException("Failed to send OTP email. Please try again.")
 
@@ -193,87 +867,408 @@ class EmailService:
     def send_register_mail(to_email, otp, expire_minutes):
         subject = 'Welcome to Gym Trainer'
         message = f'Your One-Time Password (OTP) is: {otp}. It will expire in {expire_minutes} minutes.'
-        from_email = settings.DEFAULT_FROM_EMAIL
-        html_message = render_to_string("users/register_email.html", context={"otp_code": otp})
-        image_list = [('gym-logo.webp', 'image1')]
+        html_message = EmailAssetCache.render_template("users/register_email.html", {"otp_code": otp})
+        image_list = [EmailService.LOGO_IMAGE]
 
-        EmailService.send_mail_with_image_file(
-            subject, message, from_email,
-            to_email, html_message, image_list
+        EmailQueueService.enqueue(
+            subject, message, to_email,
+            html_message=html_message, image_list=image_list
         )
 
     @staticmethod
-    def send_forget_password_mail(to_email, otp, expire_minutes):
+    def build_forget_password_mail(to_email, otp, expire_minutes):
         subject = 'Forget Password @Gym Trainer'
         message = f'Your One-Time Password (OTP) is: {otp}. It will expire in {expire_minutes} minutes.'
-        from_email = settings.DEFAULT_FROM_EMAIL
-        html_message = render_to_string("users/forget_password_email.html", context={"otp_code": otp})
-        image_list = [('gym-logo.webp', 'image1')]
+        html_message = EmailAssetCache.render_template("users/forget_password_email.html", {"otp_code": otp})
+        image_list = [EmailService.LOGO_IMAGE]
 
-        EmailService.send_mail_with_image_file(
-            subject, message, from_email,
-            to_email, html_message, image_list
-        )
+        return {
+            "subject": subject, "message": message, "to_email": to_email,
+            "html_message": html_message, "image_list": image_list,
+        }
 
     @staticmethod
-    def send_mail_with_image_file(subject, message, from_email,
-                                to_email, html_message, image_list, 
-                                document_list=[]):
-        
+    def send_forget_password_mail(to_email, otp, expire_minutes):
+        EmailQueueService.enqueue(**EmailService.build_forget_password_mail(to_email, otp, expire_minutes))
+
+    @staticmethod
+    async def asend_forget_password_mail(to_email, otp, expire_minutes):
+        await EmailQueueService.aenqueue(**EmailService.build_forget_password_mail(to_email, otp, expire_minutes))
+
+    @staticmethod
+    def build_mail_with_image_file(subject, message, from_email,
+                                to_email, html_message, image_list,
+                                document_list=[], connection=None):
+
         msg = EmailMultiAlternatives(
             subject=subject,
             body=message,  # Plain-text fallback
             from_email=from_email,
-            to=[to_email]
+            to=[to_email],
+            connection=connection,
         )
 
-        msg.attach_alternative(html_message, "text/html")
+        if html_message:
+            msg.attach_alternative(html_message, "text/html")
 
         for image_filename, image_cid in image_list:
-            image_path = finders.find(image_filename)
-            if image_path:  # Check if image exists
-                with open(image_path, 'rb') as fp:
-                    image = MIMEImage(fp.read())
-                    image.add_header('Content-ID', f'<{image_cid}>')
-                    image.add_header('Content-Disposition', 'inline', filename=image_filename)
-                    msg.attach(image)
+            image = EmailAssetCache.get_inline_image(image_filename, image_cid)
+            if image:  # Check if image exists
+                msg.attach(image)
 
         for document_filename in document_list:
-            document_path = finders.find(document_filename)
-            if document_path:
-                with open(document_path, 'rb') as f:
-                    doc = MIMEApplication(f.read())
-                    doc.add_header('Content-Disposition', 'attachment', filename=document_filename)
-                    msg.attach(doc)
+            doc = EmailAssetCache.get_attachment(document_filename)
+            if doc:
+                msg.attach(doc)
+
+        return msg
+
+    @staticmethod
+    def send_mail_with_image_file(subject, message, from_email,
+                                to_email, html_message, image_list, 
+                                document_list=[]):
 
+        msg = EmailService.build_mail_with_image_file(
+            subject, message, from_email,
+            to_email, html_message, image_list, document_list
+        )
         msg.send()
 
+class EmailAssetCache:
+    """
+    Keeps resolved static paths, encoded MIME parts and compiled templates in
+    memory so a send only clones cached parts. Entries are rebuilt when the
+    underlying file's mtime changes.
+    """
+    _cache = LRUCache(maxsize=settings.EMAIL_ASSET_CACHE_SIZE)
+
+    @staticmethod
+    def get_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def find_static(filename):
+        return EmailAssetCache._cache.get_or_set(("path", filename), lambda: finders.find(filename))
+
+    @staticmethod
+    def get_cached_part(key, path, build_part):
+        mtime = EmailAssetCache.get_mtime(path)
+        cached = EmailAssetCache._cache.get(key)
+
+        if cached is None or cached[0] != mtime:
+            with open(path, 'rb') as fp:
+                part = build_part(fp.read())
+            cached = (mtime, part)
+            EmailAssetCache._cache.set(key, cached)
+
+        # Parts are attached to a new message on every send, never share one
+        return copy.deepcopy(cached[1])
+
+    @staticmethod
+    def get_inline_image(image_filename, image_cid):
+        image_path = EmailAssetCache.find_static(image_filename)
+        if not image_path:
+            return None
+
+        def build_image(data):
+            # Python < 3.13 can't sniff webp, take the subtype from the filename
+            image_subtype = (mimetypes.guess_type(image_filename)[0] or "image/png").split("/")[1]
+            image = MIMEImage(data, _subtype=image_subtype)
+            image.add_header('Content-ID', f'<{image_cid}>')
+            image.add_header('Content-Disposition', 'inline', filename=image_filename)
+            return image
+
+        return EmailAssetCache.get_cached_part(("image", image_filename, image_cid), image_path, build_image)
+
+    @staticmethod
+    def get_attachment(document_filename):
+        document_path = EmailAssetCache.find_static(document_filename)
+        if not document_path:
+            return None
+
+        def build_document(data):
+            doc = MIMEApplication(data)
+            doc.add_header('Content-Disposition', 'attachment', filename=document_filename)
+            return doc
+
+        return EmailAssetCache.get_cached_part(("document", document_filename), document_path, build_document)
+
+    @staticmethod
+    def get_template(template_name):
+        key = ("template", template_name)
+        cached = EmailAssetCache._cache.get(key)
+
+        if cached is not None and cached[0] == EmailAssetCache.get_mtime(cached[1].origin.name):
+            return cached[1]
+
+        template = get_template(template_name)
+        EmailAssetCache._cache.set(key, (EmailAssetCache.get_mtime(template.origin.name), template))
+        return template
+
+    @staticmethod
+    def render_template(template_name, context):
+        return EmailAssetCache.get_template(template_name).render(context)
+
+    @staticmethod
+    def clear():
+        EmailAssetCache._cache.clear()
+
+class CacheWarmupService:
+    """
+    Fills caches ahead of the first requests after a deploy. Roles and hot
+    user responses go to the shared caches, so `warm_caches` can run once per
+    deploy. Email assets, the role map and the revocation Bloom filter are
+    kept per process, WARM_CACHES_ON_STARTUP fills them in each web worker.
+    """
+
+    @staticmethod
+    def warm_roles():
+        return len(RoleService.get_registry()["by_id"])
+
+    @staticmethod
+    def warm_email_assets():
+        for template_name in EmailService.HTML_TEMPLATES:
+            EmailAssetCache.get_template(template_name)
+        EmailAssetCache.get_inline_image(*EmailService.LOGO_IMAGE)
+        return len(EmailService.HTML_TEMPLATES) + 1
+
+    @staticmethod
+    def get_hot_user_ids(limit, days):
+        """Users with the most successful logins in the last `days` days."""
+        return list(
+            LoginEvent.objects
+            .filter(success=True, user__isnull=False, created_at__gte=timezone.now() - timedelta(days=days))
+            .values("user_id")
+            .annotate(logins=Count("id"))
+            .order_by("-logins")
+            .values_list("user_id", flat=True)[:limit]
+        )
+
+    @staticmethod
+    def warm_users(limit, days):
+        users = User.objects.select_related("userprofile__role").filter(
+            pk__in=CacheWarmupService.get_hot_user_ids(limit, days), is_active=True,
+        )
+
+        warmed = 0
+        for user in users:
+            UserResponseCacheService.fill(user, TokenVersionService.get_version(user.pk))
+            warmed += 1
+        return warmed
+
+    @staticmethod
+    def warm_process():
+        """Per-process caches only, cheap enough for every worker start."""
+        CacheWarmupService.warm_roles()
+        CacheWarmupService.warm_email_assets()
+        # First sync of the revocation Bloom filter, may replay the whole log
+        get_revocation_store().sync()
+
+class EmailQueueService:
+    """
+    Durable outbound mail queue. Requests only write an OutboundEmail row,
+    the `run_email_workers` command drains it over long-lived SMTP connections.
+    """
+
+    @staticmethod
+    def enqueue(subject, message, to_email, html_message=None,
+                image_list=None, document_list=None):
+        outbound_email = OutboundEmail.objects.create(
+            to_email=to_email,
+            subject=subject,
+            body=message,
+            html_body=html_message,
+            images=[list(image) for image in (image_list or [])],
+            documents=list(document_list or []),
+        )
+
+        if not settings.EMAIL_QUEUE_ENABLED:
+            # Queue disabled (local development), deliver once committed
+            SideEffectService.defer(EmailQueueService.send_batch, [outbound_email])
+
+        return outbound_email
+
+    @staticmethod
+    async def aenqueue(subject, message, to_email, html_message=None,
+                image_list=None, document_list=None):
+        outbound_email = await OutboundEmail.objects.acreate(
+            to_email=to_email,
+            subject=subject,
+            body=message,
+            html_body=html_message,
+            images=[list(image) for image in (image_list or [])],
+            documents=list(document_list or []),
+        )
+
+        if not settings.EMAIL_QUEUE_ENABLED:
+            await sync_to_async(SideEffectService.defer)(EmailQueueService.send_batch, [outbound_email])
+
+        return outbound_email
+
+    @staticmethod
+    def claim_batch(batch_size=None):
+        batch_size = batch_size or settings.EMAIL_QUEUE_BATCH_SIZE
+        now = timezone.now()
+
+        # Pending rows that are due, plus "sending" rows whose lease ran out
+        # because the worker holding them died
+        claimable = OutboundEmail.objects.filter(
+            status__in=["pending", "sending"],
+            next_attempt_at__lte=now,
+        )
+        candidate_ids = list(
+            claimable.order_by("next_attempt_at", "id").values_list("id", flat=True)[:batch_size]
+        )
+        if not candidate_ids:
+            return []
+
+        # The conditional UPDATE is the claim, a row can only be won by one worker
+        claim_token = uuid.uuid4()
+        claimable.filter(id__in=candidate_ids).update(
+            status="sending",
+            claim_token=claim_token,
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_QUEUE_LEASE_SECONDS),
+        )
+
+        return list(OutboundEmail.objects.filter(claim_token=claim_token, status="sending"))
+
+    @staticmethod
+    def get_retry_delay(attempts):
+        delay = settings.EMAIL_QUEUE_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+        delay = min(delay, settings.EMAIL_QUEUE_RETRY_MAX_SECONDS)
+        return delay + random.uniform(0, delay / 10)
+
+    @staticmethod
+    def send_batch(outbound_emails, connection=None):
+        connection = connection or get_connection()
+        sent_count = 0
+
+        for outbound_email in outbound_emails:
+            outbound_email.attempts += 1
+
+            try:
+                msg = EmailService.build_mail_with_image_file(
+                    outbound_email.subject, outbound_email.body, settings.DEFAULT_FROM_EMAIL,
+                    outbound_email.to_email, outbound_email.html_body,
+                    outbound_email.images, outbound_email.documents,
+                    connection=connection,
+                )
+
+                # One message per call so a failure is attributed to its row,
+                # the SMTP session stays open across the whole batch
+                connection.send_messages([msg])
+            except Exception as e:
+                logger.warning("Sending email %s failed: %s", outbound_email.pk, e)
+                # Drop a possibly broken session, the next send reconnects
+                connection.close()
+
+                outbound_email.last_error = str(e)
+                if outbound_email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+                    outbound_email.status = "failed"
+                else:
+                    outbound_email.status = "pending"
+                    outbound_email.next_attempt_at = timezone.now() + timedelta(
+                        seconds=EmailQueueService.get_retry_delay(outbound_email.attempts)
+                    )
+            else:
+                outbound_email.status = "sent"
+                outbound_email.sent_at = timezone.now()
+                sent_count += 1
+
+            outbound_email.claim_token = None
+            outbound_email.save(update_fields=[
+                "status", "attempts", "next_attempt_at", "claim_token",
+                "last_error", "sent_at", "updated_at",
+            ])
+
+        return sent_count
+
 class LoginService:
     @staticmethod
     def get_client_ip(request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+        num_proxies = drf_api_settings.NUM_PROXIES
+
+        # Like DRF's NUM_PROXIES, but trusting no proxy when unset. Each of our
+        # proxies appends the address it got the request from, anything left
+        # of those entries was sent by the client.
+        if not num_proxies or not x_forwarded_for:
+            return request.META.get('REMOTE_ADDR')
+
+        addresses = [address.strip() for address in x_forwarded_for.split(',')]
+        return addresses[-min(num_proxies, len(addresses))]
     
+    # Raw UA string (or its digest when unusually long) -> "browser on OS"
+    _device_cache = LRUCache(maxsize=settings.USER_AGENT_CACHE_SIZE)
+
+    @staticmethod
+    def parse_device(user_agent_string):
+        def parse():
+            user_agent = parse_user_agent(user_agent_string)
+            return f"{user_agent.browser.family} on {user_agent.os.family}"
+
+        key = user_agent_string
+        if len(key) > 512:
+            key = hashlib.sha1(key.encode()).hexdigest()
+
+        return LoginService._device_cache.get_or_set(key, parse)
+
     @staticmethod
     def get_device_info(request):
-        user_agent = parse_user_agent(request.META.get('HTTP_USER_AGENT', ''))
-        device = f"{user_agent.browser.family} on {user_agent.os.family}"
-        return device
+        return LoginService.parse_device(request.META.get('HTTP_USER_AGENT', ''))
+
+    @staticmethod
+    def get_device_info_batch(user_agent_strings):
+        # Parse each distinct string once, keep the input order
+        devices = {
+            user_agent_string: LoginService.parse_device(user_agent_string or '')
+            for user_agent_string in set(user_agent_strings)
+        }
+        return [devices[user_agent_string] for user_agent_string in user_agent_strings]
+
+    @staticmethod
+    def get_device_cache_stats():
+        return LoginService._device_cache.stats()
     
     @staticmethod
     def get_location(ip):
-        try:
-            response = requests.get(f'https://ipapi.co/{ip}/json/')
-            data = response.json()
-            print("data =========== ", data)
-            return f"{data.get('city')}, {data.get('country_name')}"
-        except:
-            return "Unknown Location"
+        return get_geoip_resolver().resolve(ip)
         
+    @staticmethod
+    def record_login(request, user=None, success=True):
+        """Captures the request details now, resolves and stores them as a side effect."""
+        email = request.data.get("email") if hasattr(request.data, "get") else None
+
+        SideEffectService.defer(LoginService.store_login_event, {
+            "user_id": user.pk if user else None,
+            "email": email if isinstance(email, str) else None,
+            "ip": LoginService.get_client_ip(request),
+            "user_agent": request.META.get('HTTP_USER_AGENT', ''),
+            "success": success,
+            "created_at": timezone.now(),
+        })
+
+    @staticmethod
+    def store_login_event(login_data):
+        ip = login_data["ip"]
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            ip = None
+
+        login_event_buffer.add(LoginEvent(
+            user_id=login_data["user_id"],
+            email=login_data["email"],
+            ip=ip,
+            device=LoginService.parse_device(login_data["user_agent"]),
+            location=LoginService.get_location(ip),
+            success=login_data["success"],
+            created_at=login_data["created_at"],
+        ))
+
     @staticmethod
     def get_login_info(request):
         ip = LoginService.get_client_ip(request)
@@ -287,5 +1282,64 @@ class LoginService:
         }
 
 
+class LoginEventBuffer:
+    """
+    Append-only buffer of LoginEvent rows, written with one bulk_create every
+    LOGIN_EVENT_BUFFER_SIZE events or LOGIN_EVENT_FLUSH_MS milliseconds.
+    Events still buffered when the process is killed are lost.
+    """
 
+    def __init__(self, max_size, flush_interval):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.events = []
+        self._lock = threading.Lock()
+        self._flusher = None
 
+    def add(self, event):
+        with self._lock:
+            self.events.append(event)
+            should_flush = len(self.events) >= self.max_size
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self.run_flusher, name="login-event-flusher", daemon=True)
+                self._flusher.start()
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            events, self.events = self.events, []
+
+        if not events:
+            return
+
+        try:
+            LoginEvent.objects.bulk_create(events)
+        except IntegrityError:
+            # A user was deleted while their events were buffered. Their stored
+            # events went with them (CASCADE), drop the buffered ones too.
+            user_ids = set(User.objects.filter(
+                pk__in={event.user_id for event in events if event.user_id},
+            ).values_list("pk", flat=True))
+            events = [event for event in events if event.user_id is None or event.user_id in user_ids]
+
+            try:
+                LoginEvent.objects.bulk_create(events)
+            except Exception:
+                logger.exception("Writing %s login events failed", len(events))
+        except Exception:
+            logger.exception("Writing %s login events failed", len(events))
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            close_old_connections()
+
+login_event_buffer = LoginEventBuffer(
+    max_size=settings.LOGIN_EVENT_BUFFER_SIZE,
+    flush_interval=settings.LOGIN_EVENT_FLUSH_MS / 1000,
+)
+atexit.register(login_event_buffer.flush)
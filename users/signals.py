@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.dispatch import receiver
+from django.core.signals import request_started, request_finished
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db.backends.signals import connection_created
+
+from common.perf_utils import install_db_timer
+
+from .models import Role, User, UserProfile
+from .services import RoleService, TokenVersionService, SideEffectService
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def invalidate_role_registry(sender, **kwargs):
+    RoleService.invalidate()
+
+
+@receiver(post_save, sender=Role)
+@receiver(pre_delete, sender=Role)
+def bump_role_token_versions(sender, instance, created=False, **kwargs):
+    # Profiles of a deleted role are nulled by a queryset update, without signals
+    if not created:
+        TokenVersionService.bump_many(
+            UserProfile.objects.filter(role=instance).values_list("user_id", flat=True)
+        )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_user_token_version(sender, instance, **kwargs):
+    TokenVersionService.bump(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def bump_profile_token_version(sender, instance, **kwargs):
+    TokenVersionService.bump(instance.user_id)
+
+
+request_started.connect(SideEffectService.request_started)
+request_finished.connect(SideEffectService.request_finished)
+
+# Query timing for common.middleware.PerformanceMiddleware, queries skip it
+# entirely while sampling is off
+if settings.PERF_SAMPLE_RATE > 0:
+    connection_created.connect(install_db_timer)
@@ -0,0 +1,99 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .services import LoginService
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Sliding-window counter throttle shared by every worker through the cache.
+
+    The rate comes from DEFAULT_THROTTLE_RATES under "<view.throttle_scope>_<ident_name>",
+    a view without a configured rate is not throttled. Counters are per fixed
+    window and bumped with the cache's atomic incr(), the previous window's
+    count is weighted by how much of it still overlaps the sliding window.
+    """
+    ident_name = None
+
+    def get_ident_value(self, request):
+        raise NotImplementedError(".get_ident_value() must be overridden")
+
+    def get_rate(self, view):
+        scope = getattr(view, "throttle_scope", None)
+        if not scope:
+            return None, None
+        self.scope = f"{scope}_{self.ident_name}"
+
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return None, None
+
+        num, period = rate.split("/")
+        duration = {"s": 1, "m": 60, "h": 3600, "d": 86400}[period[0]]
+        return int(num), duration
+
+    def allow_request(self, request, view):
+        self.num_requests, self.duration = self.get_rate(view)
+        if self.num_requests is None:
+            return True
+
+        ident = self.get_ident_value(request)
+        if not ident:
+            return True
+
+        cache = caches[settings.THROTTLE_CACHE_ALIAS]
+        self.now = time.time()
+        window = int(self.now // self.duration)
+        key = f"throttle:{self.scope}:{ident}"
+
+        # Kept for two windows, it is still read as the "previous" one
+        cache.add(f"{key}:{window}", 0, self.duration * 2)
+        try:
+            self.current_count = cache.incr(f"{key}:{window}")
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(f"{key}:{window}", 1, self.duration * 2)
+            self.current_count = 1
+        self.previous_count = cache.get(f"{key}:{window - 1}", 0)
+
+        return self.get_weighted_count() <= self.num_requests
+
+    def get_elapsed_fraction(self):
+        return (self.now % self.duration) / self.duration
+
+    def get_weighted_count(self):
+        return self.previous_count * (1 - self.get_elapsed_fraction()) + self.current_count
+
+    def wait(self):
+        remaining_in_window = self.duration - (self.now % self.duration)
+
+        if self.current_count > self.num_requests or not self.previous_count:
+            return math.ceil(remaining_in_window)
+
+        # Time until the previous window's weight decays enough
+        required_fraction = 1 - (self.num_requests - self.current_count) / self.previous_count
+        wait = (required_fraction - self.get_elapsed_fraction()) * self.duration
+        return max(math.ceil(min(wait, remaining_in_window)), 1)
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    ident_name = "ip"
+
+    def get_ident_value(self, request):
+        return LoginService.get_client_ip(request)
+
+
+class EmailRateThrottle(SlidingWindowThrottle):
+    ident_name = "email"
+
+    def get_ident_value(self, request):
+        email = request.data.get("email") if hasattr(request.data, "get") else None
+        if not isinstance(email, str):
+            return None
+        return email.strip().lower() or None
@@ -6,18 +6,34 @@ from rest_framework_simplejwt.views import (
 from .views import (
     RegisterView, LoginView, GenerateOTPView, VerifyOTPView,
     ChangePasswordView, GetUpdateUserView,
-    ResetPasswordView, CustomTokenObtainPairView,
+    ResetPasswordView, CustomTokenObtainPairView, BulkImportUsersView,
+    LoginEventListView, UserListView, UserSearchView, LogoutView,
+)
+from .async_views import (
+    AsyncGenerateOTPView, AsyncVerifyOTPView, AsyncResetPasswordView,
+    AsyncGetUpdateUserView,
 )
 
 urlpatterns = [
+    path('', UserListView.as_view(), name='user-list'),
+    path('search/', UserSearchView.as_view(), name='user-search'),
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', CustomTokenObtainPairView.as_view(), name='login'),
     path('login/refresh/', TokenRefreshView.as_view(), name='login-refresh'),
+    path('logout/', LogoutView.as_view(), name='logout'),
     path('django-login/', LoginView.as_view(), name='django-login'),
     path('otp/', GenerateOTPView.as_view(), name='generate-otp'),
     path('verify-otp/', VerifyOTPView.as_view(), name='verify-otp'),
     path('reset-password/', ResetPasswordView.as_view(), name='reset-password'),
     path('change-password/', ChangePasswordView.as_view(), name='change-password'),
     path('me/', GetUpdateUserView.as_view(), name='get-update-user'),
+    path('me/logins/', LoginEventListView.as_view(), name='login-events'),
+    path('import/', BulkImportUsersView.as_view(), name='bulk-import-users'),
+
+    # Async variants for ASGI deployments
+    path('async/otp/', AsyncGenerateOTPView.as_view(), name='async-generate-otp'),
+    path('async/verify-otp/', AsyncVerifyOTPView.as_view(), name='async-verify-otp'),
+    path('async/reset-password/', AsyncResetPasswordView.as_view(), name='async-reset-password'),
+    path('async/me/', AsyncGetUpdateUserView.as_view(), name='async-get-update-user'),
 ]
 
@@ -1,37 +1,91 @@
 # views.py
+import io
+import os
 import random
 from datetime import timedelta
 
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 
 from rest_framework.views import APIView
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
+from common.db_routers import ReplicaReadMixin, use_primary
 from common.exception_utils import CustomAPIException
+from common.pagination_utils import KeysetPagination
 
 from .models import (
-    User, OTP
+    User, OTP, LoginEvent
 )
-from .services import EmailService, OTPService, UserService
+from .services import (
+    EmailService, OTPService, UserService, UserImportService, LoginService, UserSearchService,
+    TokenRevocationService, TokenVersionService, UserResponseCacheService,
+)
+from .throttling import IPRateThrottle, EmailRateThrottle
+from .permissions import IsTrainerOrAdmin
 
 from .serializers import (
     RegisterSerializer, LoginSerializer, OTPSerializer, VerifyOTPSerializer,
     ChangePasswordSerializer, UserSerializer, ForgetPasswordSerializer,
-    ResetPasswordSerializer, CustomTokenObtainPairSerializer,
+    ResetPasswordSerializer, CustomTokenObtainPairSerializer, LoginEventSerializer,
 )
 
 class RegisterView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = "register"
     serializer_class = RegisterSerializer
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = "login"
     serializer_class = CustomTokenObtainPairSerializer
 
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except AuthenticationFailed:
+            LoginService.record_login(request, success=False)
+            raise
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        LoginService.record_login(request, user=serializer.user)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+class LogoutView(APIView):
+    """Revokes the given refresh token and the access token of the request."""
+
+    def post(self, request):
+        raw_refresh = request.data.get('refresh')
+        if not raw_refresh:
+            raise CustomAPIException("Invalid data was given", data={"refresh": ["This field is required."]})
+
+        try:
+            refresh = RefreshToken(raw_refresh)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        if str(refresh.get(api_settings.USER_ID_CLAIM)) != str(request.user.pk):
+            raise CustomAPIException("Invalid data was given", data={"refresh": ["Token belongs to another user."]})
+
+        TokenRevocationService.revoke(refresh)
+        TokenRevocationService.revoke(request.auth)
+        return Response({"message": "Logged out successfully"})
+
 class LoginView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = "login"
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -40,6 +94,8 @@ class LoginView(APIView):
 
 class GenerateOTPView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = "otp"
     def post(self, request):
         email = request.data.get("email")
         otp_type = "forget_password"
@@ -56,20 +112,23 @@ class GenerateOTPView(APIView):
 
 class VerifyOTPView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = "verify_otp"
     def post(self, request):
         serializer = VerifyOTPSerializer(data=request.data)
 
         if not serializer.is_valid():
             raise CustomAPIException("Invalid data was given", data=serializer.errors)
 
-        user, otp_type = serializer.validated_data
+        user_id, otp_type = serializer.validated_data
 
         if otp_type == "forget_password":
+            user = User.objects.get(pk=user_id)
             token = UserService.generate_password_reset_token(user)
             return Response({"message": "OTP verified", "reset_token": token})
         elif otp_type == "sign_up":
-            user.is_active = True
-            user.save()
+            User.objects.filter(pk=user_id).update(is_active=True, updated_at=timezone.now())
+            UserResponseCacheService.invalidate(user_id)
             return Response({"message": "OTP verified and account activated"})
         
 
@@ -84,11 +143,125 @@ class ResetPasswordView(APIView):
         serializer.save()
         return Response({"message": "Password reset successfully"})
 
-class GetUpdateUserView(generics.RetrieveUpdateDestroyAPIView):
+class GetUpdateUserView(ReplicaReadMixin, generics.RetrieveUpdateDestroyAPIView):
+    """
+    GET answers from UserResponseCacheService with a strong ETag (the user's
+    token version) and Last-Modified, and with 304 to a matching
+    If-None-Match or If-Modified-Since without serializing anything.
+    """
     serializer_class = UserSerializer
 
     def get_object(self):
-        return self.request.user
+        # One query for user, profile and role. A claims-only request user has
+        # no row loaded at all, a database one would lazy-load each level.
+        return User.objects.select_related('userprofile__role').get(pk=self.request.user.pk)
+
+    def get_version(self):
+        # Claims are only trusted while the token's `ver` is the current one
+        if getattr(self.request.user, 'is_stateless', False):
+            return self.request.auth['ver']
+        return TokenVersionService.get_version(self.request.user.pk)
+
+    def get_cached_response(self, version):
+        entry = UserResponseCacheService.get(self.request.user.pk, version)
+        if entry is not None:
+            return entry
+
+        # Filled from the primary, replica lag would stay cached for the whole version
+        with use_primary():
+            user = self.get_object()
+        return UserResponseCacheService.fill(user, version, self.get_serializer(user).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        # The browsable API's HTML isn't the same bytes for the same version
+        if request.accepted_renderer.format != 'json':
+            return super().retrieve(request, *args, **kwargs)
+
+        version = self.get_version()
+        headers = {'ETag': f'"{version}"', 'Cache-Control': 'private, no-cache', 'Vary': 'Authorization'}
+
+        # If-None-Match wins over If-Modified-Since, and needs no cache entry
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            if_none_match = parse_etags(if_none_match)
+            if '*' in if_none_match or headers['ETag'] in if_none_match:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        entry = self.get_cached_response(version)
+        headers['Last-Modified'] = http_date(entry['last_modified'])
+
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+        if if_none_match is None and if_modified_since is not None and entry['last_modified'] <= if_modified_since:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(entry['data'], headers=headers)
+
+class LoginEventListView(ReplicaReadMixin, generics.ListAPIView):
+    serializer_class = LoginEventSerializer
+    # Newest first, a seek on the (user, -created_at, -id) index per page
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return LoginEvent.objects.filter(user_id=self.request.user.pk)
+
+class UserListView(ReplicaReadMixin, generics.ListAPIView):
+    """
+    User directory for trainers and admins, newest first.
+
+    Query params: `role` (role name), `is_active` (true/false), `search`
+    (email or full name prefix), `fields` (comma separated subset of
+    UserSerializer's fields), `cursor` and `page_size`.
+    """
+    serializer_class = UserSerializer
+    permission_classes = [IsTrainerOrAdmin]
+    pagination_class = KeysetPagination
+
+    def get_requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        return [field.strip() for field in fields.split(',') if field.strip()]
+
+    def get_queryset(self):
+        queryset = User.objects.all()
+        params = self.request.query_params
+
+        requested_fields = self.get_requested_fields()
+        if requested_fields is None or 'profile' in requested_fields:
+            queryset = queryset.select_related('userprofile__role')
+
+        if params.get('role'):
+            queryset = queryset.filter(userprofile__role__name=params['role'])
+
+        if params.get('is_active'):
+            is_active = params['is_active'].lower()
+            if is_active not in ('true', 'false'):
+                raise CustomAPIException("Invalid data was given", data={"is_active": ["Must be true or false."]})
+            queryset = queryset.filter(is_active=is_active == 'true')
+
+        search = params.get('search', '').strip()
+        if search:
+            queryset = queryset.filter(
+                Q(email__istartswith=search) | Q(userprofile__full_name__istartswith=search)
+            )
+
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+class UserSearchView(UserListView):
+    """
+    Substring search over email and full name through UserSearchService.
+    Takes `q` plus every UserListView query param.
+    """
+
+    def get_queryset(self):
+        term = self.request.query_params.get('q', '').strip()
+        if not term:
+            raise CustomAPIException("Invalid data was given", data={"q": ["This query param is required."]})
+        return UserSearchService.search(term, super().get_queryset())
 
 class ChangePasswordView(APIView):
 
@@ -98,3 +271,17 @@ class ChangePasswordView(APIView):
             raise CustomAPIException("Invalid data was given", data=serializer.errors)
         serializer.save()
         return Response({"message": "Password changed successfully"})
+
+class BulkImportUsersView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if not upload:
+            raise CustomAPIException("A CSV or JSON Lines file is required in 'file'")
+
+        file_format = request.data.get("format") or os.path.splitext(upload.name)[1].lstrip(".").lower()
+        stream = io.TextIOWrapper(upload.file, encoding="utf-8", errors=UserImportService.DECODE_ERRORS, newline="")
+
+        report = UserImportService.import_users(stream, file_format)
+        return Response(report)